@@ -1,24 +1,84 @@
+from django import forms
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef, Subquery
 from django_filters import rest_framework as filters
-from recipes.models import Ingredient, Recipe
+from django_filters.widgets import QueryArrayWidget
+from recipes.cache import get_tag_ids
+from recipes.models import Recipe
+from recipes.search import search_ranking
 
 
-class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(
-        field_name='name',
-        lookup_expr='istartswith',)
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-id'),
+}
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+
+class SlugListField(forms.Field):
+    widget = QueryArrayWidget
+
+    def to_python(self, value):
+        return list(value or [])
+
+
+class SlugListFilter(filters.Filter):
+    field_class = SlugListField
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug',)
+    """Фильтр рецептов. Теги передаются как ?tags=a&tags=b, по умолчанию
+    выбираются рецепты хотя бы с одним из тегов, при tags_mode=all —
+    со всеми сразу. С ?search= рецепты отбираются по названию, описанию
+    и ингредиентам и сортируются по релевантности. ?ordering=popular
+    сортирует рецепты по числу добавлений в избранное.
+    """
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('new', 'сначала новые'), ('popular', 'сначала популярные')),
+        method='filter_ordering')
+    tags = SlugListFilter(method='filter_tags')
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'любой из тегов'), ('all', 'все теги')),
+        method='filter_tags_mode')
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        ids = {tag_ids[slug] for slug in value if slug in tag_ids}
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            if len(ids) < len(value):
+                return queryset.none()
+            return queryset.filter(id__in=(
+                Recipe.tags.through.objects
+                .filter(tag_id__in=ids)
+                .values('recipe_id')
+                .annotate(matched=Count('tag_id'))
+                .filter(matched=len(ids))
+                .values('recipe_id')))
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=ids)))
+
+    def filter_tags_mode(self, queryset, name, value):
+        # Учитывается в filter_tags.
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        ranking = search_ranking(value)
+        if ranking is None:
+            return queryset.none()
+        best = ranking.order_by('-score', '-recipe_id').values('recipe_id')
+        return queryset.filter(
+            id__in=best[:settings.SEARCH_MAX_RESULTS],
+        ).annotate(search_score=Subquery(
+            ranking.filter(recipe_id=OuterRef('pk')).values('score'),
+        )).order_by('-search_score', '-id')
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -33,4 +93,5 @@ class RecipeFilter(filters.FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('search', 'ordering', 'tags', 'author', 'is_favorited',
+                  'is_in_shopping_cart')
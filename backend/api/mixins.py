@@ -0,0 +1,47 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from recipes.cache import get_version
+
+
+class ConditionalCacheMixin:
+    """Кэширование list и retrieve для справочных данных.
+    Ответ хранится в кэше под текущей версией данных cache_version,
+    клиент получает ETag и Last-Modified, а на повторный запрос
+    с If-None-Match — 304 без обращения к базе.
+    """
+    cache_version = None
+    cache_responses = True
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        version = get_version(self.cache_version)
+        path_hash = md5(request.get_full_path().encode()).hexdigest()
+        etag = quote_etag(f'{self.cache_version}-{version}-{path_hash}')
+        last_modified = int(version)
+        response = get_conditional_response(request, etag, last_modified)
+        if response is None:
+            key = f'response:{self.cache_version}:{version}:{path_hash}'
+            data = cache.get(key) if self.cache_responses else None
+            if data is not None:
+                response = Response(data)
+            else:
+                response = view(request, *args, **kwargs)
+                if self.cache_responses and response.status_code == 200:
+                    cache.set(key, response.data,
+                              settings.REFERENCE_CACHE_TIMEOUT)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -1,6 +1,148 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+from functools import partial
 
+from django.core.paginator import Paginator as DjangoPaginator
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
-class CustomPagination(PageNumberPagination):
+from recipes.cache import RECIPES, cached_count
+from .filters import RECIPE_ORDERINGS
+
+
+class CountedPaginator(DjangoPaginator):
+    """Paginator, который получает число объектов от пагинации DRF."""
+    def __init__(self, *args, get_count, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.get_count = get_count
+
+    @cached_property
+    def count(self):
+        return self.get_count(self.object_list)
+
+
+class CountMixin:
+    """Число объектов берётся из кэша, если задана версия count_version
+    и в запросе нет фильтров, зависящих от пользователя. Уже собранные
+    в памяти списки считаются без запросов.
+    """
+    count_version = None
+    user_filter_params = ()
+
+    def get_count(self, queryset):
+        if isinstance(queryset, list):
+            return len(queryset)
+        if self.count_version is None or any(
+                param in self.request.query_params
+                for param in self.user_filter_params):
+            return queryset.count()
+        return cached_count(queryset, self.count_version)
+
+
+class CustomPagination(CountMixin, PageNumberPagination):
     page_size_query_param = 'limit'
-   
\ No newline at end of file
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.django_paginator_class = partial(CountedPaginator,
+                                              get_count=self.get_count)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class CustomCursorPagination(CountMixin, CursorPagination):
+    """Постраничный вывод по курсору: следующая страница выбирается
+    условием по ключу сортировки, без OFFSET. Общее число объектов
+    считается только по запросу с параметром count=true.
+    """
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = self.get_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class RecipeCountMixin:
+    count_version = RECIPES
+    user_filter_params = ('is_favorited', 'is_in_shopping_cart')
+
+
+class RecipeCursorPagination(RecipeCountMixin, CustomCursorPagination):
+    """Курсор строится по тому же ключу сортировки, что выбран
+    параметром ordering.
+    """
+    ordering = RECIPE_ORDERINGS['new']
+    ordering_query_param = 'ordering'
+
+    def get_ordering(self, request, queryset, view):
+        return RECIPE_ORDERINGS.get(
+            request.query_params.get(self.ordering_query_param),
+            self.ordering)
+
+
+class SubscriptionCursorPagination(CustomCursorPagination):
+    ordering = ('id', )
+
+
+class SwitchablePagination(CustomPagination):
+    """Номера страниц по умолчанию и курсор, если в запросе передан
+    параметр cursor или pagination=cursor. Параметры page_number_params
+    задают свой порядок вывода, с ними всегда используются номера страниц.
+    """
+    cursor_pagination_class = None
+    mode_query_param = 'pagination'
+    page_number_params = ()
+
+    def use_cursor(self, request):
+        if any(param in request.query_params
+               for param in self.page_number_params):
+            return False
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_pagination_class.cursor_query_param
+                in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePagination(RecipeCountMixin, SwitchablePagination):
+    """Порядок popular выводится только по номерам страниц: курсор DRF
+    запоминает лишь первое поле сортировки, а у favorites_count много
+    одинаковых значений, и смещение внутри них ограничено
+    offset_cutoff.
+    """
+    cursor_pagination_class = RecipeCursorPagination
+    page_number_params = ('search', )
+    page_number_orderings = ('popular', )
+
+    def use_cursor(self, request):
+        ordering = request.query_params.get(
+            self.cursor_pagination_class.ordering_query_param)
+        return (ordering not in self.page_number_orderings
+                and super().use_cursor(request))
+
+
+class SubscriptionPagination(SwitchablePagination):
+    cursor_pagination_class = SubscriptionCursorPagination
@@ -0,0 +1,76 @@
+import csv
+import json
+from itertools import groupby
+from operator import itemgetter
+
+from rest_framework import renderers
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанную строку."""
+    def write(self, value):
+        return value
+
+
+def capitalize(name):
+    return name[:1].upper() + name[1:]
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Базовый класс для выгрузки списка покупок.
+    Строки списка — кортежи (единица измерения, название, количество),
+    отсортированные по единице измерения.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, str)):
+            return data
+        return json.dumps(data, ensure_ascii=False)
+
+    def groups(self, rows):
+        return groupby(rows, key=itemgetter(0))
+
+    def stream(self, user, rows):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, rows):
+        yield f'Список покупок пользователя: {user}\n'
+        for unit, items in self.groups(rows):
+            yield f'\n{unit}:\n'
+            for _, name, amount in items:
+                yield f'{capitalize(name)} ({unit}) - {amount}\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, user, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('measurement_unit', 'name', 'amount'))
+        for unit, name, amount in rows:
+            yield writer.writerow((unit, capitalize(name), amount))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, user, rows):
+        yield '{"user": %s, "groups": [' % json.dumps(str(user),
+                                                      ensure_ascii=False)
+        for index, (unit, items) in enumerate(self.groups(rows)):
+            yield '%s{"measurement_unit": %s, "items": [' % (
+                ', ' if index else '', json.dumps(unit, ensure_ascii=False))
+            for position, (_, name, amount) in enumerate(items):
+                yield (', ' if position else '') + json.dumps(
+                    {'name': capitalize(name), 'amount': amount},
+                    ensure_ascii=False)
+            yield ']}'
+        yield ']}'
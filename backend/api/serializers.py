@@ -1,18 +1,31 @@
 import base64
+import binascii
+from io import BytesIO
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from django.db import transaction
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
 
+from recipes.cache import get_recipe_fragments
+from recipes.images import validate_image, variant_urls
 from recipes.models import (Favorite, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingCart, Tag)
+                            RecipeIngredient, ShoppingCart,
+                            ShoppingCartIngredient, Tag)
 from users.models import Subscribe
-from .utils import UserCreateMixin
+from .utils import UserCreateMixin, get_recipes_limit
 
 User = get_user_model()
 
+BASE64_MARKER = ';base64,'
+BASE64_CHUNK_SIZE = 64 * 1024
+BASE64_WHITESPACE = str.maketrans('', '', ' \t\n\r\v\f')
+
 
 class CustomUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -23,18 +36,33 @@ class CustomUserSerializer(UserSerializer):
                   'first_name', 'last_name', 'is_subscribed',)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return (request and request.user.is_authenticated
                 and Subscribe.objects.filter(following=obj, user=request.user
                                              ).exists())
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin:
+    """Адреса уменьшенных вариантов картинки рецепта."""
+    def get_image_variants(self, obj):
+        request = self.context.get('request')
+        urls = variant_urls(obj)
+        if request is None:
+            return urls
+        return {variant: request.build_absolute_uri(url)
+                for variant, url in urls.items()}
+
+
+class RecipeShortSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     """Сериализатор для вывода информации о добавленном рецепте .
     """
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubsribeUserSerializer(CustomUserSerializer):
@@ -51,21 +79,18 @@ class SubsribeUserSerializer(CustomUserSerializer):
                   'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and Subscribe.objects.filter(following=obj, user=request.user
-                                             ).exists())
-
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is None:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            recipes = obj.recipes.all()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         serializer = RecipeShortSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -91,14 +116,75 @@ class CustomUserCreateSerializer(UserCreateMixin, serializers.ModelSerializer):
 
 class Base64ImageField(serializers.ImageField):
     """Сериализатор для картинки.
+    Строка base64 декодируется частями в файл загрузки: небольшие
+    картинки остаются в памяти, крупные пишутся во временный файл.
+    Размер проверяется до декодирования.
     """
+    default_error_messages = {
+        'invalid_base64': 'Некорректная картинка в формате base64.',
+        'too_large': 'Размер картинки не должен превышать {max_size} байт.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        start = data.find(BASE64_MARKER)
+        if start == -1:
+            self.fail('invalid_base64')
+        content_type = data[len('data:'):start]
+        start += len(BASE64_MARKER)
+        size = (len(data) - start) * 3 // 4 - data.count('=', -2)
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        name = 'temp.' + content_type.split('/')[-1]
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            upload = TemporaryUploadedFile(name, content_type, size, None)
+        else:
+            upload = InMemoryUploadedFile(
+                BytesIO(), None, name, content_type, size, None)
+        # Переносы строк и пробелы допустимы в base64 и отбрасываются.
+        # После этого часть может не делиться на 4, поэтому остаток
+        # декодируется вместе со следующей частью.
+        rest = ''
+        try:
+            for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = data[offset:offset + BASE64_CHUNK_SIZE]
+                chunk = rest + chunk.translate(BASE64_WHITESPACE)
+                end = len(chunk) - len(chunk) % 4
+                upload.write(base64.b64decode(chunk[:end], validate=True))
+                rest = chunk[end:]
+            if rest:
+                base64.b64decode(rest, validate=True)
+        except binascii.Error:
+            upload.close()
+            self.fail('invalid_base64')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Сериализатор для загрузки картинки рецепта файлом.
+    """
+    image = serializers.ImageField(validators=[validate_image])
+
+    class Meta:
+        model = Recipe
+        fields = ('image', )
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам.
+    """
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для игредиентов.
@@ -133,24 +219,84 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 class RecipeIngredientShortSerializer(serializers.ModelSerializer):
     """Сериализатор для ввода информации об ингредиентах.
     """
-    id = serializers.PrimaryKeyRelatedField(source='ingredient',
-                                            queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(source='ingredient')
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов, собранный из сохранённых в кэше фрагментов."""
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, models.Manager)
+                       else data)
+        return self.child.represent(recipes)
+
+
+class RecipeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     """Сериализатор для получения рецепта и списка рецептов.
+    Общая для всех пользователей часть рецепта берётся из кэша,
+    поверх неё выставляются отметки текущего пользователя.
     """
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     image = Base64ImageField(required=False, allow_null=True)
+    image_variants = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def represent(self, recipes):
+        for recipe in recipes:
+            self.set_user_flags(recipe)
+        fragments = get_recipe_fragments(recipes, self.build_fragments)
+        return [self.overlay(recipe, fragments[recipe.id])
+                for recipe in recipes]
+
+    def set_user_flags(self, recipe):
+        """Вычисляет отметки пользователя один раз, если они не были
+        получены аннотациями queryset'а.
+        """
+        if hasattr(recipe, 'author_subscribed'):
+            recipe.author.is_subscribed = recipe.author_subscribed
+        else:
+            recipe.author.is_subscribed = self.fields[
+                'author'].get_is_subscribed(recipe.author)
+        recipe.favorited = self.get_is_favorited(recipe)
+        recipe.in_shopping_cart = self.get_is_in_shopping_cart(recipe)
+
+    def build_fragments(self, recipes):
+        prefetch_related_objects(recipes,
+                                 *Recipe.objects.prefetch_lookups())
+        fragments = {}
+        for recipe in recipes:
+            fragment = super().to_representation(recipe)
+            fragment['image'] = recipe.image.url if recipe.image else None
+            fragment['image_variants'] = variant_urls(recipe)
+            fragments[recipe.id] = fragment
+        return fragments
+
+    def overlay(self, instance, fragment):
+        """Добавляет к фрагменту данные, зависящие от пользователя."""
+        request = self.context.get('request')
+        data = dict(fragment)
+        data['author'] = {
+            **fragment['author'],
+            'is_subscribed': instance.author.is_subscribed}
+        data['is_favorited'] = self.get_is_favorited(instance)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        if request is not None:
+            if data['image']:
+                data['image'] = request.build_absolute_uri(data['image'])
+            data['image_variants'] = {
+                variant: request.build_absolute_uri(url)
+                for variant, url in fragment['image_variants'].items()}
+        return data
+
     def get_ingredients(self, obj):
         """Определение ингредиентов в рецепте."""
         recipe = obj
@@ -159,12 +305,16 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_favorited(self, obj):
         """Проверка есть ли рецепт в избранном."""
+        if hasattr(obj, 'favorited'):
+            return obj.favorited
         request = self.context.get('request')
         return (request.user.is_authenticated and Favorite.objects.filter(
             user=request.user, recipe=obj).exists())
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка есть ли рецепт в списке покупок."""
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         request = self.context.get('request')
         return (request.user.is_authenticated and ShoppingCart.objects.filter(
                 user=request.user, recipe=obj).exists())
@@ -173,16 +323,19 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author',  'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time')
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time')
+        list_serializer_class = RecipeListSerializer
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания, изменения и удаления рецепта.
     """
     ingredients = RecipeIngredientShortSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
-    image = Base64ImageField(use_url=True, required=False)
+    tags = serializers.ListField(child=serializers.IntegerField(),
+                                 allow_empty=False)
+    image = Base64ImageField(use_url=True, required=False,
+                             validators=[validate_image])
 
     class Meta:
         model = Recipe
@@ -190,15 +343,11 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'name', 'text', 'cooking_time')
 
     def validate(self, data):
+        self.resolve_objects(data)
         if not data.get('ingredients'):
             raise serializers.ValidationError(
                 'Нужно указать один ингредиент.'
             )
-        for ingredient in data.get('ingredients'):
-            if not Ingredient.objects.filter(
-                    id=ingredient['ingredient'].id).exists():
-                raise serializers.ValidationError(
-                    f'Такого ингредиента {ingredient} нет в базе.')
         if not data.get('tags'):
             raise serializers.ValidationError(
                 'Нужно указать тег.')
@@ -211,14 +360,61 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         tag_list = [tag.id for tag in data.get('tags')]
         if len(tag_list) != len(set(tag_list)):
             raise serializers.ValidationError('Такой тег уже есть в рецепте.')
-        if (Recipe.objects
-                .filter(name=data.get('text'))
-                .filter(author=self.context.get('request').user)
-                .exists()) and self.context.get('request').method != 'PATCH':
-            raise serializers.ValidationError(
+        if 'name' in data:
+            recipes = Recipe.objects.filter(
+                name=data['name'], author=self.context.get('request').user)
+            if self.instance is not None:
+                recipes = recipes.exclude(pk=self.instance.pk)
+            if recipes.exists():
+                raise serializers.ValidationError(
                     'Вы уже вносили такой рецепт!')
         return data
 
+    def resolve_objects(self, data):
+        """Заменяет id ингредиентов и тегов объектами из базы,
+        загружая каждую модель одним запросом.
+        """
+        message = (serializers.PrimaryKeyRelatedField
+                   .default_error_messages['does_not_exist'])
+
+        def does_not_exist(pk_value):
+            return ErrorDetail(message.format(pk_value=pk_value),
+                               code='does_not_exist')
+
+        ingredients = data.get('ingredients', [])
+        found_ingredients = Ingredient.objects.in_bulk(
+            {ingredient['ingredient'] for ingredient in ingredients})
+        found_tags = Tag.objects.in_bulk(set(data.get('tags', [])))
+        errors = {}
+        ingredient_errors = [
+            {} if ingredient['ingredient'] in found_ingredients
+            else {'id': [does_not_exist(ingredient['ingredient'])]}
+            for ingredient in ingredients]
+        if any(ingredient_errors):
+            errors['ingredients'] = ingredient_errors
+        tag_errors = [does_not_exist(tag_id)
+                      for tag_id in data.get('tags', [])
+                      if tag_id not in found_tags]
+        if tag_errors:
+            errors['tags'] = tag_errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        for ingredient in ingredients:
+            ingredient['ingredient'] = found_ingredients[
+                ingredient['ingredient']]
+        if 'tags' in data:
+            data['tags'] = [found_tags[tag_id] for tag_id in data['tags']]
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл картинки из base64 уже перемещён хранилищем,
+            # закрываем его, пока этого не сделал сборщик мусора.
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
     @transaction.atomic
     def create(self, validated_data):
         """Функция сохранения в базе при создании рецепта.
@@ -227,12 +423,11 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         tags_data = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags_data)
-        for ingredient in ingredients_data:
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=ingredient['ingredient'],
-                amount=ingredient['amount'])
-        recipe.save()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe,
+                             ingredient=ingredient['ingredient'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients_data)
         return recipe
 
     @transaction.atomic
@@ -241,24 +436,54 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         """
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags_data)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
         for field, value in validated_data.items():
             setattr(instance, field, value)
-        for ingredient in ingredients_data:
-            RecipeIngredient.objects.create(
-                recipe=instance,
-                ingredient=ingredient['ingredient'],
-                amount=ingredient['amount'])
         instance.save()
+        instance.tags.set(tags_data)
+        changed_ingredients = self.update_ingredients(instance,
+                                                      ingredients_data)
+        if changed_ingredients:
+            ShoppingCartIngredient.objects.refresh(
+                ShoppingCart.objects.filter(recipe=instance).values('user'),
+                changed_ingredients)
         return instance
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """Добавляет, удаляет и изменяет только отличающиеся ингредиенты
+        рецепта. Возвращает id затронутых ингредиентов.
+        """
+        current = {recipe_ingredient.ingredient_id: recipe_ingredient
+                   for recipe_ingredient in recipe.recipe_ingredient.all()}
+        amounts = {ingredient['ingredient'].id: ingredient['amount']
+                   for ingredient in ingredients_data}
+        removed = current.keys() - amounts.keys()
+        added = amounts.keys() - current.keys()
+        changed = [recipe_ingredient
+                   for ingredient_id, recipe_ingredient in current.items()
+                   if ingredient_id in amounts
+                   and recipe_ingredient.amount != amounts[ingredient_id]]
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        if added:
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                 amount=amounts[ingredient_id])
+                for ingredient_id in added)
+        if changed:
+            for recipe_ingredient in changed:
+                recipe_ingredient.amount = amounts[
+                    recipe_ingredient.ingredient_id]
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        return removed | added | {
+            recipe_ingredient.ingredient_id for recipe_ingredient in changed}
+
     def to_representation(self, instance):
+        prefetch_related_objects([instance],
+                                 *Recipe.objects.prefetch_lookups())
         self.fields.pop('ingredients')
         self.fields['tags'] = TagSerializer(many=True)
         representation = super().to_representation(instance)
         representation['ingredients'] = RecipeIngredientSerializer(
-            RecipeIngredient.objects.filter(recipe=instance).all(), many=True
-            ).data
+            instance.recipe_ingredient.all(), many=True).data
         return representation
@@ -0,0 +1,238 @@
+import os
+import shutil
+import tempfile
+import time
+from base64 import b64encode
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from foodgram.metrics import REQUESTS_TOTAL, registry
+from api.serializers import Base64ImageField, RecipeCreateSerializer
+from recipes.management.commands.benchmark_api import LOCAL_CACHES
+from recipes.images import build_variants
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.seed import seed_database
+
+User = get_user_model()
+
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABie'
+         'ywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAAC'
+         'klEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg==')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RecipeListQueriesTest(TestCase):
+    """Число SQL-запросов списка рецептов не зависит от размера
+    страницы: подсчёт, рецепты с флагами пользователя, теги и
+    ингредиенты.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=5, recipes=60)[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_count_shared_between_users(self):
+        other = seed_database(users=1, recipes=0, seed=1)[0]
+        self.client.get('/api/recipes/')
+        self.client.force_authenticate(other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'COUNT(' in query['sql']])
+
+    def test_list(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(4):
+                    response = self.client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+
+@override_settings(CACHES=LOCAL_CACHES, RECIPE_IMAGE_WORKERS=0)
+class RecipeImageVariantsTest(TestCase):
+    """Варианты картинок разных рецептов не перезаписывают друг друга,
+    даже если картинки загружены в base64 под одним именем или рецепты
+    ссылаются на один файл, как после import_recipes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=1, recipes=0)[0]
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'name': name,
+                'text': 'Описание рецепта',
+                'cooking_time': 5,
+                'image': IMAGE,
+                'tags': [Tag.objects.values_list('id', flat=True)[0]],
+                'ingredients': [{
+                    'id': Ingredient.objects.values_list('id', flat=True)[0],
+                    'amount': 10}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(name=name)
+
+    def assertSeparateVariants(self, first, second):
+        for variant in ('thumbnail', 'webp'):
+            with self.subTest(variant=variant):
+                self.assertNotEqual(first.image_variants[variant],
+                                    second.image_variants[variant])
+                for recipe in (first, second):
+                    self.assertTrue(recipe.image.storage.exists(
+                        recipe.image_variants[variant]))
+
+    def test_uploaded_images(self):
+        self.assertSeparateVariants(self.create_recipe('Первый'),
+                                    self.create_recipe('Второй'))
+
+    def test_shared_image(self):
+        first = self.create_recipe('Первый')
+        second = Recipe.objects.create(
+            author=self.user, name='Второй', text='Описание рецепта',
+            cooking_time=5, image=first.image.name)
+        self.assertTrue(build_variants(second.id, second.image.name))
+        second.refresh_from_db()
+        self.assertSeparateVariants(first, second)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_DIR='',
+                   METRICS_TOKEN='secret', INTERNAL_IPS=[])
+class MetricsAccessTest(TestCase):
+    """/api/metrics доступны только по токену и администраторам."""
+    def test_anonymous(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+
+    def test_wrong_token(self):
+        response = self.client.get('/api/metrics',
+                                   HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    def test_token(self):
+        response = self.client.get('/api/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'foodgram_requests_total', response.content)
+
+    def test_api_token(self):
+        user = User.objects.create_user('metrics', 'metrics@example.com')
+        token = Token.objects.create(user=user)
+        for is_staff, status in ((False, 403), (True, 200)):
+            with self.subTest(is_staff=is_staff):
+                User.objects.filter(pk=user.pk).update(is_staff=is_staff)
+                response = self.client.get(
+                    '/api/metrics', HTTP_AUTHORIZATION=f'Token {token.key}')
+                self.assertEqual(response.status_code, status)
+
+    def test_background_flush(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+        with self.settings(METRICS_DIR=metrics_dir,
+                           METRICS_FLUSH_INTERVAL=0.01):
+            registry.inc(REQUESTS_TOTAL, (('route', 'test'),))
+            registry.start_flusher()
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            with open(path) as source:
+                self.assertIn('test', source.read())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PopularPaginationTest(TestCase):
+    """Список popular выводится целиком и без повторов, даже если
+    у большинства рецептов одинаковое число добавлений в избранное.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(users=2, recipes=1300, ingredients_per_recipe=1,
+                      favorites=0, carts=0)
+
+    def test_all_pages(self):
+        seen = []
+        url = '/api/recipes/?pagination=cursor&ordering=popular&limit=100'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            self.assertLessEqual(len(seen), Recipe.objects.count())
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), Recipe.objects.count())
+
+
+class Base64DecodeTest(TestCase):
+    """Строка base64 декодируется частями, пробелы и переносы строк
+    внутри неё пропускаются.
+    """
+    content = bytes(range(256)) * 4
+
+    def decode(self, encoded):
+        upload = Base64ImageField().decode(
+            f'data:image/png;base64,{encoded}')
+        return upload.read()
+
+    def test_line_breaks(self):
+        encoded = b64encode(self.content).decode()
+        wrapped = '\r\n'.join(
+            encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        for chunk_size in (7, 64, 1024 * 64):
+            with self.subTest(chunk_size=chunk_size), mock.patch(
+                    'api.serializers.BASE64_CHUNK_SIZE', chunk_size):
+                self.assertEqual(self.decode(wrapped + '\n'), self.content)
+
+    def test_invalid(self):
+        for encoded in ('abc', 'ab*d', b64encode(b'x').decode() + 'A'):
+            with self.subTest(encoded=encoded):
+                with self.assertRaises(ValidationError):
+                    self.decode(encoded)
+
+
+class RecipeUnknownObjectsTest(TestCase):
+    """Несуществующие ингредиенты и теги возвращают ошибку
+    с кодом does_not_exist, как у PrimaryKeyRelatedField.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=1, recipes=0)[0]
+
+    def test_error_codes(self):
+        request = mock.Mock(user=self.user)
+        serializer = RecipeCreateSerializer(data={
+            'name': 'Рецепт',
+            'text': 'Описание рецепта',
+            'cooking_time': 5,
+            'image': IMAGE,
+            'tags': [0],
+            'ingredients': [{'id': 0, 'amount': 10}],
+        }, context={'request': request})
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors
+        self.assertEqual(errors['tags'][0].code, 'does_not_exist')
+        self.assertEqual(errors['ingredients'][0]['id'][0].code,
+                         'does_not_exist')
@@ -1,6 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from foodgram.metrics import metrics_view
+
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
                     TagViewSet)
 
@@ -14,8 +16,10 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
     path('users/subscriptions/', CustomUserViewSet.as_view(
-        {'get': 'subscriptions'})),
+        {'get': 'subscriptions'},
+        **CustomUserViewSet.subscriptions.kwargs)),
     path('', include('djoser.urls')),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
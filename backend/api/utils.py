@@ -16,3 +16,11 @@ class UserCreateMixin:
         with transaction.atomic():
             user = User.objects.create_user(**validated_data)
         return user
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если он не задан."""
+    try:
+        return max(int(request.query_params['recipes_limit']), 0)
+    except (KeyError, ValueError):
+        return None
@@ -1,25 +1,37 @@
+from collections import defaultdict
 from http import HTTPStatus
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import Count, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from users.models import Subscribe
-from recipes.models import (Favorite, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingCart, Tag)
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from recipes.autocomplete import ingredient_index
+from recipes.cache import INGREDIENTS, TAGS
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingCartIngredient, Tag)
+from recipes.pantry import pantry_index
+from .filters import RecipeFilter
+from .mixins import ConditionalCacheMixin
+from .pagination import (CustomPagination, RecipePagination,
+                         SubscriptionPagination)
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeCreateSerializer,
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
+from .serializers import (IngredientSerializer, PantrySerializer,
+                          RecipeCreateSerializer, RecipeImageSerializer,
                           RecipeSerializer, RecipeShortSerializer,
                           SubsribeUserSerializer, TagSerializer)
+from .utils import get_recipes_limit
 
 User = get_user_model()
 
@@ -27,10 +39,22 @@ User = get_user_model()
 class CustomUserViewSet(UserViewSet):
     permission_classes = (IsAuthenticated,)
 
-    @action(detail=False, pagination_class=CustomPagination)
+    @action(detail=False, pagination_class=SubscriptionPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(followed__user=request.user)
+        queryset = (
+            User.objects
+            .filter(followed__user=request.user)
+            .annotate(recipes_count=Count('recipes', distinct=True),
+                      is_subscribed=Value(True))
+            .order_by('id'))
         page = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.latest_by_author(
+            page, get_recipes_limit(request))
+        previews = defaultdict(list)
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        for author in page:
+            author.recipes_preview = previews[author.id]
         serializer = SubsribeUserSerializer(page, many=True,
                                             context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -54,27 +78,51 @@ class CustomUserViewSet(UserViewSet):
             return Response(status=HTTPStatus.NO_CONTENT)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_version = TAGS
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientFilter
+    cache_version = INGREDIENTS
+    # Список и так отдаётся из индекса в памяти процесса.
+    cache_responses = False
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(self.search, request)
+
+    def search(self, request):
+        """Список ингредиентов из индекса в памяти.
+        С параметром ?name= — автодополнение по началу и части названия.
+        """
+        name = request.query_params.get('name')
+        if name is None:
+            return Response(ingredient_index.all())
+        return Response(ingredient_index.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT))
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
     permission_classes = (IsAuthorOrReadOnly, )
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'from_ingredients'):
+            # Теги и ингредиенты подгружаются сериализатором только для
+            # рецептов, которых нет в кэше.
+            queryset = queryset.select_related('author').with_user_flags(
+                self.request.user)
+        return queryset
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -91,6 +139,41 @@ class RecipeViewSet(viewsets.ModelViewSet):
         context.update({'request': self.request})
         return context
 
+    @action(detail=False, pagination_class=CustomPagination)
+    def from_ingredients(self, request):
+        """Рецепты, которые можно приготовить из ингредиентов
+        ?ingredients=1&ingredients=2, по убыванию доли имеющихся
+        ингредиентов. ?max_missing= ограничивает число недостающих.
+        """
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        matches = pantry_index.match(
+            serializer.validated_data['ingredients'],
+            settings.PANTRY_MAX_RESULTS,
+            serializer.validated_data.get('max_missing'))
+        page = self.paginate_queryset(matches)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        # Рецепт мог быть удалён после обновления индекса.
+        page = [match for match in page if match[0] in recipes]
+        data = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True,
+            context=self.get_serializer_context()).data
+        for recipe, (_, coverage, missing) in zip(data, page):
+            recipe['coverage'] = round(coverage, 2)
+            recipe['missing_ingredients'] = missing
+        return self.get_paginated_response(data)
+
+    @action(detail=True, methods=['put'], parser_classes=(MultiPartParser,))
+    def image(self, request, **kwargs):
+        """Загрузка картинки рецепта в multipart/form-data без base64."""
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(recipe, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(RecipeShortSerializer(
+            recipe, context={'request': request}).data)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, **kwargs):
@@ -132,25 +215,27 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 return Response(status=HTTPStatus.NO_CONTENT)
             return Response(status=HTTPStatus.BAD_REQUEST)
 
-    @action(detail=False, permission_classes=(IsAuthenticated,))
+    @action(detail=False, permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListJSONRenderer))
     def download_shopping_cart(self, request):
+        """Потоковая выгрузка списка покупок.
+        Формат выбирается параметром ?format=txt|csv|json.
+        """
         user = request.user
         ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__recipe_in_shopping_cart__user=user)
-            .values('ingredient')
-            .annotate(total_amount=Sum('amount'))
-            .values_list('ingredient__name',
-                         'ingredient__measurement_unit',
-                         'total_amount'))
-        file_data = [f'Список покупок пользователя: {user}']
-        for ingredient in ingredients:
-            # ingredient[0] = ingredient[0].capitalize()
-            file_data.append(
-                f'{ingredient[0]} ({ingredient[1]}) - {ingredient[2]}'
-                )
-        response = HttpResponse('\n'.join(file_data).capitalize(),
-                                content_type="text/plain")
+            ShoppingCartIngredient.objects
+            .filter(user=user)
+            .order_by('ingredient__measurement_unit', 'ingredient__name')
+            .values_list('ingredient__measurement_unit',
+                         'ingredient__name',
+                         'total_amount')
+            .iterator(chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE))
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(user, ingredients),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.txt"')
+            f'attachment; filename="shopping_cart.{renderer.format}"')
         return response
@@ -0,0 +1,272 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .profiling import QueryRecorder
+
+REQUESTS_TOTAL = 'foodgram_requests_total'
+REQUEST_DURATION = 'foodgram_request_duration_seconds'
+REQUEST_QUERIES = 'foodgram_request_queries'
+RESPONSE_SIZE = 'foodgram_response_size_bytes'
+
+COUNTERS = {
+    REQUESTS_TOTAL: 'Число обработанных запросов.',
+}
+HISTOGRAMS = {
+    REQUEST_DURATION: (
+        'Время обработки запроса в секундах.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    REQUEST_QUERIES: (
+        'Число SQL-запросов на один запрос к API.',
+        (0, 1, 2, 3, 5, 10, 20, 50, 100)),
+    RESPONSE_SIZE: (
+        'Размер тела ответа в байтах.',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+}
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    return '{%s}' % ','.join(f'{name}="{escape(value)}"'
+                             for name, value in pairs)
+
+
+class Registry:
+    """Счётчики и гистограммы текущего процесса.
+
+    Если задана METRICS_DIR, каждый процесс записывает свои значения
+    в METRICS_DIR/<pid>.json: фоновый поток раз в METRICS_FLUSH_INTERVAL
+    секунд, если значения изменились, а также при выдаче метрик и при
+    завершении. При выдаче метрик файлы всех процессов суммируются,
+    так что метрики не зависят от того, какой воркер gunicorn обработал
+    запрос к /api/metrics.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.dirty = False
+        self.flusher_pid = None
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.dirty = True
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        with self.lock:
+            self.dirty = True
+            # Число наблюдений в каждом интервале, последний — +Inf,
+            # затем сумма значений.
+            data = self.histograms.setdefault(
+                (name, labels), [0] * (len(buckets) + 1) + [0])
+            data[bisect_left(buckets, value)] += 1
+            data[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self.counters.items()],
+                'histograms': [[name, labels, list(data)]
+                               for (name, labels), data
+                               in self.histograms.items()],
+            }
+
+    def start_flusher(self):
+        """Запускает фоновую запись в текущем процессе. Поток создаётся
+        заново после fork, поэтому проверяется pid.
+        """
+        if not settings.METRICS_DIR or self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(target=self.run_flusher, name='metrics-flusher',
+                         daemon=True).start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self.dirty:
+                self.flush()
+
+    def flush(self):
+        if not settings.METRICS_DIR:
+            return
+        path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(temporary, path)
+
+    def collect(self):
+        """Суммирует значения всех процессов."""
+        if not settings.METRICS_DIR:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(
+                    os.path.join(settings.METRICS_DIR, '*.json')):
+                try:
+                    with open(path) as source:
+                        snapshots.append(json.load(source))
+                except (OSError, ValueError):
+                    continue
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, data in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(data))
+                for index, value in enumerate(data):
+                    total[index] += value
+        return counters, histograms
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}',
+                      f'# TYPE {name} counter']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}',
+                      f'# TYPE {name} histogram']
+            for (metric, labels), data in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), data):
+                    cumulative += count
+                    lines.append(f'{name}_bucket'
+                                 f'{format_labels(labels, le=bound)} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {data[-1]}')
+                lines.append(f'{name}_count{format_labels(labels)} '
+                             f'{cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def route_name(request):
+    """Имя маршрута: класс и действие viewset'а, например
+    RecipeViewSet.list, или имя URL для обычных представлений.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.route
+    action = (getattr(match.func, 'actions', None) or {}).get(
+        request.method.lower())
+    return f'{view_class.__name__}.{action}' if action else (
+        view_class.__name__)
+
+
+class MetricsMiddleware:
+    """Собирает время обработки, число SQL-запросов и размер ответа
+    по маршрутам и методам. Включается настройкой METRICS_ENABLED.
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryRecorder()
+        started = time.perf_counter()
+        with queries.record():
+            response = self.get_response(request)
+        labels = (('route', route_name(request)),
+                  ('method', request.method))
+        registry.inc(REQUESTS_TOTAL,
+                     labels + (('status', str(response.status_code)),))
+        registry.observe(REQUEST_DURATION, labels,
+                         time.perf_counter() - started)
+        registry.observe(REQUEST_QUERIES, labels, queries.count)
+        registry.start_flusher()
+        if response.streaming:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, labels)
+        else:
+            registry.observe(RESPONSE_SIZE, labels, len(response.content))
+        return response
+
+    def measure_stream(self, content, labels):
+        size = 0
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+        registry.observe(RESPONSE_SIZE, labels, size)
+
+
+def is_staff(request):
+    """Администратор по сессии или по токену API: обычное представление
+    Django не проходит аутентификацию DRF, поэтому она выполняется
+    здесь.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    api_request = Request(request, authenticators=[
+        authentication() for authentication
+        in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return api_request.user.is_staff
+    except APIException:
+        return False
+
+
+def metrics_allowed(request):
+    """Метрики видны по токену METRICS_TOKEN в заголовке Authorization,
+    с адресов INTERNAL_IPS и администраторам.
+    """
+    token = settings.METRICS_TOKEN
+    if token and constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return (request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+            or is_staff(request))
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not metrics_allowed(request):
+        raise PermissionDenied
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
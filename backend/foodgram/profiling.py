@@ -0,0 +1,157 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+_serializer_timing = ContextVar('serializer_timing', default=None)
+
+
+class QueryRecorder:
+    """Считает SQL-запросы всех подключений к базе и время их выполнения.
+    Используется как execute_wrapper.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def duplicates(self):
+        """Повторы одного и того же SQL с разными параметрами —
+        типичный признак N+1.
+        """
+        return {sql: count for sql, count in self.statements.items()
+                if count > 1}
+
+
+class SerializerTiming:
+    """Время в serializer.data. Вложенные сериализаторы не учитываются
+    повторно.
+    """
+    def __init__(self):
+        self.duration = 0.0
+        self.depth = 0
+
+
+def timed_data(prop):
+    @wraps(prop.fget)
+    def data(serializer):
+        timing = _serializer_timing.get()
+        if timing is None:
+            return prop.fget(serializer)
+        timing.depth += 1
+        started = time.perf_counter()
+        try:
+            return prop.fget(serializer)
+        finally:
+            timing.depth -= 1
+            if not timing.depth:
+                timing.duration += time.perf_counter() - started
+    return property(data)
+
+
+def instrument_serializers():
+    for serializer_class in (serializers.Serializer,
+                             serializers.ListSerializer):
+        if not getattr(serializer_class.data.fget, '__wrapped__', None):
+            serializer_class.data = timed_data(serializer_class.data)
+
+
+class ProfilingMiddleware:
+    """Замеряет для каждого запроса число и время SQL-запросов, повторы
+    запросов, время сериализации и общее время. Результат отдаётся
+    в заголовке Server-Timing и пишется в лог одной JSON-строкой.
+    Медленные запросы из выборки PROFILING_SAMPLE_RATE сохраняются
+    в PROFILING_DIR как дампы cProfile.
+    Включается настройкой PROFILING_ENABLED.
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        queries = QueryRecorder()
+        timing = SerializerTiming()
+        token = _serializer_timing.set(timing)
+        profiler = None
+        if settings.PROFILING_DIR and (
+                random.random() < settings.PROFILING_SAMPLE_RATE):
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with queries.record():
+                if profiler is None:
+                    response = self.get_response(request)
+                else:
+                    response = profiler.runcall(self.get_response, request)
+        finally:
+            _serializer_timing.reset(token)
+        total = (time.perf_counter() - started) * 1000
+        duplicates = queries.duplicates
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={queries.duration * 1000:.1f};'
+            f'desc="{queries.count} queries, '
+            f'{sum(duplicates.values()) - len(duplicates)} duplicates"',
+            f'serializer;dur={timing.duration * 1000:.1f}',
+            f'total;dur={total:.1f}',
+        ))
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total, 1),
+            'db_ms': round(queries.duration * 1000, 1),
+            'queries': queries.count,
+            'serializer_ms': round(timing.duration * 1000, 1),
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in Counter(duplicates).most_common(
+                    settings.PROFILING_MAX_DUPLICATES)],
+        }, ensure_ascii=False))
+        if profiler is not None and total >= settings.PROFILING_SLOW_MS:
+            self.dump(profiler, request)
+        return response
+
+    def dump(self, profiler, request):
+        name = re.sub(r'[^\w-]+', '_', request.path).strip('_')
+        path = os.path.join(
+            settings.PROFILING_DIR,
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{name}.prof')
+        try:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError:
+            logger.warning('Не удалось сохранить профиль %s', path,
+                           exc_info=True)
@@ -32,6 +32,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.profiling.ProfilingMiddleware',
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +83,58 @@ else:
         }
     }
 
+# Фрагменты рецептов, числа строк и ответы справочников. По умолчанию
+# кэш в памяти процесса: файловый кэш перечисляет всю папку при каждой
+# записи. При нескольких воркерах gunicorn нужен общий кэш, например
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# и CACHE_LOCATION=redis://redis:6379, иначе изменённый рецепт
+# удаляется из кэша только в том процессе, где его сохранили.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND',
+                          'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    },
+    # Версии данных и журнал изменений индекса ингредиентов, общие для
+    # всех процессов, включая команды manage.py. Записей не больше
+    # PANTRY_MAX_CHANGES и нескольких версий, поэтому предел не
+    # достигается и записи не вытесняются.
+    'versions': {
+        'BACKEND': os.getenv(
+            'CACHE_VERSIONS_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_VERSIONS_LOCATION',
+                              os.path.join(BASE_DIR, 'cache_versions')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+if CACHE_BACKEND.endswith('.LocMemCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+    }
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+RECIPE_CACHE_TIMEOUT = 60 * 15
+PAGINATION_COUNT_TIMEOUT = 60
+# Начиная с этого числа строк списки без фильтров в PostgreSQL
+# используют оценку планировщика вместо COUNT(*).
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = 100000
+
+RECIPE_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+RECIPE_IMAGE_MAX_SIDE = 6000
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024))
+# Название варианта: (наибольший размер, формат).
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': ((480, 480), 'JPEG'),
+    'webp': ((1280, 1280), 'WEBP'),
+}
+RECIPE_IMAGE_QUALITY = 85
+# Число потоков для обработки картинок, 0 — обработка без очереди.
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -144,4 +198,57 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32767
 MIN_INGREDIENT_AMOUNT = 1
+MAX_INGREDIENT_AMOUNT = 32767
 MAX_LINE_LENGTH = 50
+SHOPPING_LIST_CHUNK_SIZE = 2000
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Полнотекстовый поиск рецептов (?search=): обратный индекс в базе
+# и ранжирование BM25.
+SEARCH_FIELD_WEIGHTS = {'name': 3, 'ingredients': 2, 'text': 1}
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_MAX_TERMS = 10
+# Доля рецептов, начиная с которой слово запроса считается слишком
+# частым, чтобы влиять на порядок.
+SEARCH_COMMON_TERM_RATIO = 0.5
+SEARCH_MAX_RESULTS = 500
+SEARCH_STATS_TIMEOUT = 60 * 10
+SEARCH_INDEX_BATCH_SIZE = 500
+
+# Подбор рецептов по имеющимся ингредиентам: битовые маски ингредиентов
+# в памяти процесса и журнал изменений в общем кэше.
+PANTRY_MAX_INGREDIENTS = 100
+PANTRY_MAX_RESULTS = 500
+PANTRY_MAX_CHANGES = 1000
+PANTRY_CHANGES_TIMEOUT = 60 * 60
+
+# Профилирование запросов: заголовок Server-Timing, JSON-строка в логе
+# foodgram.profiling и дампы cProfile медленных запросов из выборки.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_DIR = os.getenv('PROFILING_DIR', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.1))
+PROFILING_SLOW_MS = 500
+PROFILING_MAX_DUPLICATES = 5
+
+# Метрики в формате Prometheus на /api/metrics. При нескольких воркерах
+# gunicorn METRICS_DIR — общая папка, через которую суммируются метрики
+# всех процессов; её нужно очищать при перезапуске. Метрики отдаются
+# с заголовком "Authorization: Bearer <METRICS_TOKEN>", адресам
+# INTERNAL_IPS и администраторам.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_FLUSH_INTERVAL = 1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram': {'handlers': ['console'], 'level': 'INFO'},
+        'recipes': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingCartIngredient, Tag)
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -19,10 +19,25 @@ class FavoriteInline(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline, FavoriteInline,)
-    list_display = ('name', 'author', 'times_favorited')
+    list_display = ('name', 'author', 'favorites_count')
+    readonly_fields = ('favorites_count', 'carts_count')
+    list_select_related = ('author', )
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
 
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        before = set(recipe.recipe_ingredient.values_list(
+            'ingredient_id', 'amount'))
+        super().save_related(request, form, formsets, change)
+        after = set(recipe.recipe_ingredient.values_list(
+            'ingredient_id', 'amount'))
+        changed = {ingredient_id for ingredient_id, _ in before ^ after}
+        if changed:
+            ShoppingCartIngredient.objects.refresh(
+                ShoppingCart.objects.filter(recipe=recipe).values('user'),
+                changed)
+
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
@@ -0,0 +1,65 @@
+import threading
+from bisect import bisect_left
+from operator import itemgetter
+
+from .cache import INGREDIENTS, get_version
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся в отсортированном массиве уже приведёнными к
+    нижнему регистру, поэтому поиск по префиксу — это бинарный поиск,
+    а на запрос приходится одно приведение регистра строки запроса.
+    Индекс перестраивается, когда меняется версия ингредиентов в кэше.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = None
+
+    def load(self):
+        ingredients = Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit').order_by()
+        rows = sorted(
+            ((name.casefold(), {'id': pk, 'name': name,
+                                'measurement_unit': measurement_unit})
+             for pk, name, measurement_unit in ingredients.iterator()),
+            key=itemgetter(0))
+        return [key for key, _ in rows], [item for _, item in rows]
+
+    def get_data(self):
+        version = get_version(INGREDIENTS)
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.data = self.load()
+                    self.version = version
+        return self.data
+
+    def all(self):
+        return self.get_data()[1]
+
+    def search(self, query, limit):
+        """Сначала ингредиенты, название которых начинается с query,
+        затем те, в названии которых query встречается.
+        """
+        keys, items = self.get_data()
+        query = query.casefold()
+        result = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(items[position])
+            position += 1
+        if len(result) < limit:
+            for key, item in zip(keys, items):
+                if query in key and not key.startswith(query):
+                    result.append(item)
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,127 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction
+
+from .models import Tag
+
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+RECIPES = 'recipes'
+
+
+def version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """Версия набора данных: время его последнего изменения.
+    Общий кэш делает версию одинаковой для всех процессов.
+    """
+    versions = caches['versions']
+    version = versions.get(version_key(name))
+    if version is None:
+        version = time.time()
+        if not versions.add(version_key(name), version, timeout=None):
+            version = versions.get(version_key(name), version)
+    return version
+
+
+def bump_version(name):
+    """Сдвигает версию после фиксации текущей транзакции."""
+    transaction.on_commit(lambda: caches['versions'].set(
+        version_key(name), time.time(), timeout=None))
+
+
+def get_tag_ids():
+    """Словарь slug -> id тегов, общий для всех процессов."""
+    key = f'tag_ids:{get_version(TAGS)}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.REFERENCE_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def recipe_key(recipe_id, versions):
+    return 'recipe:{}:{}:{}'.format(recipe_id, *versions)
+
+
+def recipe_versions():
+    """Рецепт включает теги и ингредиенты, поэтому их изменение
+    делает недействительными все сохранённые рецепты.
+    """
+    return get_version(TAGS), get_version(INGREDIENTS)
+
+
+def get_recipe_fragments(recipes, build):
+    """Независимая от пользователя часть представления рецептов.
+    Отсутствующие в кэше фрагменты строит build(recipes) -> {id: dict}.
+    """
+    versions = recipe_versions()
+    keys = {recipe.id: recipe_key(recipe.id, versions) for recipe in recipes}
+    cached = cache.get_many(keys.values())
+    fragments = {recipe_id: cached[key] for recipe_id, key in keys.items()
+                 if key in cached}
+    missing = [recipe for recipe in recipes if recipe.id not in fragments]
+    if missing:
+        built = build(missing)
+        cache.set_many({keys[recipe_id]: fragment
+                        for recipe_id, fragment in built.items()},
+                       settings.RECIPE_CACHE_TIMEOUT)
+        fragments.update(built)
+    return fragments
+
+
+def invalidate_recipes(recipe_ids):
+    """Удаляет сохранённые рецепты после фиксации транзакции."""
+    recipe_ids = list(recipe_ids)
+
+    def delete():
+        versions = recipe_versions()
+        cache.delete_many(
+            [recipe_key(recipe_id, versions) for recipe_id in recipe_ids])
+    transaction.on_commit(delete)
+
+
+def cached_count(queryset, name):
+    """Число объектов queryset из кэша. Ключ строится по тексту
+    SQL-запроса и версии name, которая сдвигается при добавлении
+    и удалении объектов. Аннотации и сортировка на число не влияют,
+    поэтому отбрасываются: иначе отметки пользователя из
+    with_user_flags давали бы каждому пользователю свой ключ.
+    """
+    queryset = queryset.values('pk').order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    signature = md5(f'{sql}{params}'.encode()).hexdigest()
+    key = f'count:{name}:{get_version(name)}:{signature}'
+    count = cache.get(key)
+    if count is None:
+        count = estimated_count(queryset)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_TIMEOUT)
+    return count
+
+
+def estimated_count(queryset):
+    """Оценка числа строк планировщиком PostgreSQL для запросов без
+    условий. Для небольших таблиц и других СУБД возвращает None.
+    """
+    connection = connections[queryset.db]
+    if queryset.query.where or connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row and row[0] >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+        return int(row[0])
+    return None
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .cache import invalidate_recipes
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def validate_image(value):
+    """Проверяет формат и размеры картинки по заголовку файла,
+    не декодируя её целиком.
+    """
+    image = getattr(value, 'image', None)
+    if image is None:
+        with Image.open(value) as image:
+            image_format, size = image.format, image.size
+        value.seek(0)
+    else:
+        image_format, size = image.format, image.size
+    if image_format not in settings.RECIPE_IMAGE_FORMATS:
+        raise ValidationError(
+            f'Формат {image_format} не поддерживается. Допустимые '
+            f'форматы: {", ".join(settings.RECIPE_IMAGE_FORMATS)}.')
+    if value.size > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise ValidationError(
+            'Размер картинки не должен превышать '
+            f'{settings.RECIPE_IMAGE_MAX_SIZE} байт.')
+    if max(size) > settings.RECIPE_IMAGE_MAX_SIDE:
+        raise ValidationError(
+            'Сторона картинки не должна превышать '
+            f'{settings.RECIPE_IMAGE_MAX_SIDE} пикселей.')
+
+
+def storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def variant_path(recipe_id, name, variant, image_format):
+    """Путь варианта в папке рецепта: одна картинка может быть у
+    нескольких рецептов, например после import_recipes, а варианты
+    другого рецепта перезаписывать нельзя.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return (f'recipes/variants/{recipe_id}/{stem}_{variant}.'
+            f'{EXTENSIONS[image_format]}')
+
+
+def variant_urls(recipe):
+    """Относительные адреса готовых вариантов картинки рецепта."""
+    if not recipe.image or recipe.image_variants.get(
+            'source') != recipe.image.name:
+        return {}
+    return {variant: storage().url(path)
+            for variant, path in recipe.image_variants.items()
+            if variant != 'source'}
+
+
+def render_variant(image, size, image_format):
+    image = image.copy()
+    image.thumbnail(size)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def build_variants(recipe_id, name):
+    """Создаёт уменьшенные варианты картинки и сохраняет их пути
+    в рецепте, если картинка за это время не была заменена.
+    Возвращает False, если картинку не удалось обработать.
+    """
+    try:
+        paths = {'source': name}
+        with storage().open(name) as source, Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            for variant, (size, image_format) in (
+                    settings.RECIPE_IMAGE_VARIANTS.items()):
+                path = variant_path(recipe_id, name, variant,
+                                    image_format)
+                storage().delete(path)
+                paths[variant] = storage().save(
+                    path, render_variant(image, size, image_format))
+        if Recipe.objects.filter(pk=recipe_id, image=name).update(
+                image_variants=paths):
+            invalidate_recipes([recipe_id])
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+        return False
+    return True
+
+
+def build_variants_in_worker(recipe_id, name):
+    try:
+        build_variants(recipe_id, name)
+    finally:
+        connection.close()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images')
+        return _executor
+
+
+def schedule_variants(recipe):
+    """Ставит обработку картинки в очередь после фиксации транзакции.
+    При RECIPE_IMAGE_WORKERS = 0 варианты создаются сразу.
+    """
+    args = (recipe.pk, recipe.image.name)
+
+    def submit():
+        if settings.RECIPE_IMAGE_WORKERS:
+            get_executor().submit(build_variants_in_worker, *args)
+        else:
+            build_variants(*args)
+    transaction.on_commit(submit)
@@ -0,0 +1,231 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorite, Recipe, RecipeIngredient,
+                            ShoppingCart)
+from recipes.seed import seed_database
+
+# Бюджеты по умолчанию: число запросов, медианное время в мс и пиковая
+# память в КБ. Переопределяются настройкой BENCHMARK_BUDGETS.
+DEFAULT_BUDGETS = {
+    'recipes-list-anonymous': {'queries': 5, 'time_ms': 150,
+                               'memory_kb': 2048},
+    'recipes-list': {'queries': 5, 'time_ms': 150, 'memory_kb': 2048},
+    'recipes-list-large': {'queries': 5, 'time_ms': 600,
+                           'memory_kb': 8192},
+    'recipes-list-cursor': {'queries': 4, 'time_ms': 150,
+                            'memory_kb': 2048},
+    'recipes-list-popular': {'queries': 5, 'time_ms': 150,
+                             'memory_kb': 2048},
+    'recipes-list-tags': {'queries': 5, 'time_ms': 150, 'memory_kb': 2048},
+    'recipes-search': {'queries': 6, 'time_ms': 150, 'memory_kb': 2048},
+    'recipes-from-ingredients': {'queries': 4, 'time_ms': 100,
+                                 'memory_kb': 2048},
+    'recipes-retrieve': {'queries': 4, 'time_ms': 50, 'memory_kb': 1024},
+    'subscriptions': {'queries': 3, 'time_ms': 100, 'memory_kb': 1024},
+    'ingredients-search': {'queries': 1, 'time_ms': 100,
+                           'memory_kb': 2048},
+    'download-shopping-cart': {'queries': 1, 'time_ms': 100,
+                               'memory_kb': 2048},
+}
+# Кэши в памяти процесса, чтобы замеры не зависели от общего кэша.
+LOCAL_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias}
+    for alias in ('default', 'versions')
+}
+# Индексы горячих путей из миграции 0003, без которых --baseline
+# повторяет замеры.
+BASELINE_INDEXES = {
+    Favorite: ('favorite_user_date_idx',),
+    Recipe: ('recipe_pub_date_idx', 'recipe_author_pub_date_idx'),
+    ShoppingCart: ('shoppingcart_user_date_idx',),
+}
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для замера производительности API.
+    Создаёт тестовую базу, заполняет её синтетическими данными и
+    прогоняет основные эндпоинты через тестовый клиент DRF.
+    Запускается командой из папки backend "python manage.py benchmark_api"
+    """
+    help = ('Замер числа запросов, времени и памяти для основных '
+            'эндпоинтов API с проверкой бюджетов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--recipes', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Число повторов для замера времени.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результаты в формате JSON.')
+        parser.add_argument('--no-budgets', action='store_true',
+                            help='Только вывести замеры, не проверяя '
+                                 'бюджеты.')
+        parser.add_argument('--explain', action='store_true',
+                            help='Вывести планы выполнения SELECT-запросов.')
+        parser.add_argument(
+            '--baseline', action='store_true',
+            help='Повторить замеры без индексов миграции 0003 '
+                 'для сравнения.')
+
+    @override_settings(CACHES=LOCAL_CACHES)
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        baseline = None
+        try:
+            users = seed_database(users=options['users'],
+                                  recipes=options['recipes'],
+                                  seed=options['seed'])
+            results = self.run(users[0], options)
+            if options['baseline']:
+                indexes = self.baseline_indexes()
+                with connection.schema_editor() as schema_editor:
+                    for model, index in indexes:
+                        schema_editor.remove_index(model, index)
+                baseline = self.run(users[0], options)
+                with connection.schema_editor() as schema_editor:
+                    for model, index in indexes:
+                        schema_editor.add_index(model, index)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if baseline is not None:
+            self.stdout.write('Без индексов 0003:')
+            self.report(baseline, options['json'])
+            self.stdout.write('После:')
+        self.report(results, options['json'])
+        if not options['no_budgets']:
+            self.check_budgets(results)
+
+    def baseline_indexes(self):
+        return [(model, index)
+                for model, names in BASELINE_INDEXES.items()
+                for index in model._meta.indexes if index.name in names]
+
+    def run(self, user, options):
+        return [self.measure(name, path, user, options['repeat'],
+                             options['explain'])
+                for name, path, user in self.scenarios(user)]
+
+    def scenarios(self, user):
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        pantry = '&'.join(
+            f'ingredients={ingredient_id}' for ingredient_id in
+            RecipeIngredient.objects.values_list('ingredient_id', flat=True)
+            .distinct()[:5])
+        return (
+            ('recipes-list-anonymous', '/api/recipes/', None),
+            ('recipes-list', '/api/recipes/', user),
+            ('recipes-list-large', '/api/recipes/?limit=50', user),
+            ('recipes-list-cursor', '/api/recipes/?pagination=cursor', user),
+            ('recipes-list-popular', '/api/recipes/?ordering=popular', user),
+            ('recipes-list-tags',
+             '/api/recipes/?tags=breakfast&tags=lunch&tags_mode=all', user),
+            ('recipes-search', '/api/recipes/?search=соус томатный', user),
+            ('recipes-from-ingredients',
+             f'/api/recipes/from_ingredients/?{pantry}', user),
+            ('recipes-retrieve', f'/api/recipes/{recipe_id}/', user),
+            ('subscriptions',
+             '/api/users/subscriptions/?recipes_limit=3', user),
+            ('ingredients-search', '/api/ingredients/?name=са', user),
+            ('download-shopping-cart',
+             '/api/recipes/download_shopping_cart/', user),
+        )
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(
+                f'{path} вернул статус {response.status_code}')
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    def measure(self, name, path, user, repeat, explain=False):
+        # Каждый сценарий начинается с пустого кэша, чтобы число
+        # запросов не зависело от предыдущих сценариев.
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            size = self.request(client, path)
+        statements = [query['sql'] for query in queries.captured_queries]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.request(client, path)
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        self.request(client, path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result = {
+            'name': name,
+            'path': path,
+            'queries': len(statements),
+            'time_ms': round(statistics.median(timings), 2),
+            'memory_kb': round(peak / 1024, 1),
+            'size': size,
+        }
+        if explain:
+            result['plans'] = self.explain(statements)
+        return result
+
+    def explain(self, statements):
+        prefix = connection.ops.explain_query_prefix()
+        plans = []
+        with connection.cursor() as cursor:
+            for sql in dict.fromkeys(statements):
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                cursor.execute(f'{prefix} {sql}')
+                plans.append({
+                    'sql': sql,
+                    'plan': [' '.join(map(str, row))
+                             for row in cursor.fetchall()],
+                })
+        return plans
+
+    def report(self, results, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(results, ensure_ascii=False,
+                                         indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                '{name:<26} queries={queries:<4} time={time_ms:>8} ms '
+                'memory={memory_kb:>8} KB size={size}'.format(**result))
+            for plan in result.get('plans', ()):
+                self.stdout.write(f'    {plan["sql"]}')
+                for line in plan['plan']:
+                    self.stdout.write(f'        {line}')
+
+    def check_budgets(self, results):
+        budgets = {**DEFAULT_BUDGETS,
+                   **getattr(settings, 'BENCHMARK_BUDGETS', {})}
+        failures = [
+            f'{result["name"]}: {metric}={result[metric]} > {limit}'
+            for result in results
+            for metric, limit in budgets.get(result['name'], {}).items()
+            if result[metric] > limit
+        ]
+        if failures:
+            raise CommandError('Превышены бюджеты производительности:\n'
+                               + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены.'))
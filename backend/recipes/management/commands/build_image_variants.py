@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для создания вариантов картинок
+    у рецептов, загруженных до появления обработки или с ошибкой.
+    Запускается командой из папки backend
+    "python manage.py build_image_variants [--all]"
+    """
+    help = 'Создаёт уменьшенные варианты картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать варианты для всех рецептов.')
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        for recipe_id, name, variants in list(
+                Recipe.objects.exclude(image='')
+                .values_list('id', 'image', 'image_variants')):
+            if options['all'] or variants.get('source') != name:
+                if build_variants(recipe_id, name):
+                    built += 1
+                else:
+                    failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {built}.'))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'Не удалось обработать: {failed}.'))
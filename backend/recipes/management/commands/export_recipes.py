@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для выгрузки рецептов в NDJSON:
+    одна строка — один рецепт с ингредиентами, тегами и путём к картинке.
+    Ингредиенты, теги и авторы записываются естественными ключами.
+    Запускается командой из папки backend
+    "python manage.py export_recipes recipes.ndjson"
+    """
+    help = 'Потоковая выгрузка рецептов в формате NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл для выгрузки, по умолчанию стандартный вывод.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipes = (Recipe.objects
+                   .select_related('author')
+                   .prefetch_related(*Recipe.objects.prefetch_lookups())
+                   .order_by('id')
+                   .iterator(chunk_size=options['batch_size']))
+        if options['path'] == '-':
+            exported = self.export(recipes, self.stdout)
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as output:
+                exported = self.export(recipes, output)
+        self.stderr.write(f'Выгружено рецептов: {exported}.')
+
+    def export(self, recipes, output):
+        exported = 0
+        for recipe in recipes:
+            output.write(json.dumps(self.serialize(recipe),
+                                    ensure_ascii=False) + '\n')
+            exported += 1
+        return exported
+
+    def serialize(self, recipe):
+        return {
+            'author': recipe.author.username,
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'pub_date': recipe.pub_date.isoformat(),
+            'image': recipe.image.name,
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [
+                {'name': item.ingredient.name,
+                 'measurement_unit': item.ingredient.measurement_unit,
+                 'amount': item.amount}
+                for item in recipe.recipe_ingredient.all()],
+        }
@@ -0,0 +1,128 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.cache import INGREDIENTS, bump_version
+from recipes.models import Ingredient
+
+DEFAULT_PATH = os.path.join(os.path.dirname(settings.BASE_DIR),
+                            'data', 'ingredients.csv')
+FORMATS = ('csv', 'json', 'ndjson')
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для загрузки справочника ингредиентов.
+    Повторный запуск не создаёт дублей.
+    Запускается командой из папки backend
+    "python manage.py import_ingredients [путь] [--update] [--dry-run]"
+    """
+    help = ('Пакетная загрузка ингредиентов из CSV, JSON или NDJSON '
+            'без дублей')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат файла, по умолчанию определяется по расширению.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Обновить единицу измерения у ингредиентов, которые '
+                 'есть в базе с другой единицей.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Посчитать изменения и откатить транзакцию.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = self.read(options['path'], options['format'])
+        with transaction.atomic():
+            before = Ingredient.objects.count()
+            updated = (self.update_units(rows, options['batch_size'])
+                       if options['update'] else 0)
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in rows),
+                batch_size=options['batch_size'],
+                ignore_conflicts=True)
+            created = Ingredient.objects.count() - before
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            elif created or updated:
+                # bulk-операции не отправляют сигналы.
+                bump_version(INGREDIENTS)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            '{}Прочитано {} ингредиентов, добавлено {}, обновлено {} за '
+            '{:.2f} с ({:.0f} строк/с).'.format(
+                'Пробный запуск. ' if options['dry_run'] else '',
+                len(rows), created, updated, elapsed,
+                len(rows) / elapsed if elapsed else 0)))
+
+    def read(self, path, file_format=None):
+        """Читает файл построчно и возвращает уникальные пары
+        (название, единица измерения) в исходном порядке.
+        """
+        file_format = file_format or os.path.splitext(path)[1][1:].lower()
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Не удалось определить формат файла {path}, '
+                'укажите --format.')
+        try:
+            with open(path, encoding='utf-8') as source:
+                return list(dict.fromkeys(
+                    (name.strip(), unit.strip())
+                    for name, unit in getattr(self, f'read_{file_format}')(
+                        source)))
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Некорректная строка в {path}: {error}')
+
+    def read_csv(self, source):
+        for row in csv.reader(source):
+            if row and row != ['name', 'measurement_unit']:
+                yield row
+
+    def read_json(self, source):
+        for item in json.load(source):
+            yield item['name'], item['measurement_unit']
+
+    def read_ndjson(self, source):
+        for line in source:
+            if line.strip():
+                item = json.loads(line)
+                yield item['name'], item['measurement_unit']
+
+    def update_units(self, rows, batch_size):
+        """Меняет единицу измерения, если ингредиент с таким названием
+        один и в файле, и в базе. Возвращает число обновлённых строк.
+        """
+        units = defaultdict(set)
+        for name, unit in rows:
+            units[name].add(unit)
+        existing = defaultdict(list)
+        for ingredient in Ingredient.objects.only(
+                'id', 'name', 'measurement_unit').iterator():
+            if ingredient.name in units:
+                existing[ingredient.name].append(ingredient)
+        changed = []
+        for name, ingredients in existing.items():
+            if len(ingredients) == 1 and len(units[name]) == 1:
+                ingredient = ingredients[0]
+                unit = next(iter(units[name]))
+                if ingredient.measurement_unit != unit:
+                    ingredient.measurement_unit = unit
+                    changed.append(ingredient)
+        Ingredient.objects.bulk_update(changed, ['measurement_unit'],
+                                       batch_size=batch_size)
+        return len(changed)
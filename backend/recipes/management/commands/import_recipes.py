@@ -0,0 +1,159 @@
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes.cache import RECIPES, bump_version
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.pantry import record_changes
+from recipes.search import index_recipes
+
+User = get_user_model()
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для загрузки рецептов из NDJSON,
+    созданного командой export_recipes. Файл читается пакетами, поэтому
+    память не растёт с числом рецептов. Рецепты, которые уже есть у
+    автора, пропускаются.
+    Запускается командой из папки backend
+    "python manage.py import_recipes recipes.ndjson"
+    """
+    help = 'Пакетная загрузка рецептов из NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--author',
+            help='Имя пользователя, которому назначаются все рецепты.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, unit): ingredient_id
+            for ingredient_id, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit').iterator()}
+        if options['author']:
+            author = User.objects.filter(
+                username=options['author']).values_list('id', flat=True)
+            if not author:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден.')
+            self.authors = None
+            self.author_id = author[0]
+        else:
+            self.authors = dict(User.objects.values_list('username', 'id'))
+        self.created = self.skipped = self.failed = 0
+        try:
+            with open(options['path'], encoding='utf-8') as source:
+                lines = enumerate(source, start=1)
+                while True:
+                    batch = list(islice(lines, options['batch_size']))
+                    if not batch:
+                        break
+                    self.import_batch(batch)
+        except OSError as error:
+            raise CommandError(
+                f'Не удалось прочитать {options["path"]}: {error}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {self.created}, уже были: {self.skipped}, '
+            f'с ошибками: {self.failed} за {elapsed:.2f} с.'))
+
+    def parse(self, number, line):
+        """Превращает строку файла в рецепт и список ингредиентов
+        с id из предзагруженных справочников.
+        """
+        try:
+            data = json.loads(line)
+            author_id = (self.author_id if self.authors is None
+                         else self.authors[data['author']])
+            recipe = Recipe(
+                author_id=author_id,
+                name=self.clean(Recipe, 'name', data['name']),
+                text=data['text'],
+                cooking_time=self.clean(Recipe, 'cooking_time',
+                                        data['cooking_time']),
+                image=data.get('image', ''))
+            pub_date = parse_datetime(data.get('pub_date') or '')
+            tags = [self.tags[slug] for slug in data['tags']]
+            ingredients = [
+                (self.ingredients[item['name'], item['measurement_unit']],
+                 self.clean(RecipeIngredient, 'amount', item['amount']))
+                for item in data['ingredients']]
+        except KeyError as error:
+            self.error(f'Строка {number}: не найдено {error}.')
+        except ValidationError as error:
+            self.error(f'Строка {number}: {" ".join(error.messages)}')
+        except (TypeError, ValueError) as error:
+            self.error(f'Строка {number}: {error}.')
+        else:
+            return recipe, pub_date, tags, ingredients
+
+    def clean(self, model, field, value):
+        """Проверяет значение валидаторами поля модели, в том числе
+        диапазоном целых чисел базы, чтобы одна неверная строка не
+        прерывала вставку всего пакета.
+        """
+        field = model._meta.get_field(field)
+        try:
+            return field.clean(value, None)
+        except ValidationError as error:
+            raise ValidationError(
+                [f'{field.name}: {message}' for message in error.messages])
+
+    def error(self, message):
+        self.failed += 1
+        if self.failed <= MAX_REPORTED_ERRORS:
+            self.stderr.write(message)
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        parsed = {}
+        for number, line in batch:
+            if not line.strip():
+                continue
+            item = self.parse(number, line)
+            if item is not None:
+                parsed.setdefault(
+                    (item[0].author_id, item[0].name), item)
+        existing = set(Recipe.objects.filter(
+            name__in={name for _, name in parsed},
+            author_id__in={author_id for author_id, _ in parsed},
+        ).values_list('author_id', 'name'))
+        new = [item for key, item in parsed.items() if key not in existing]
+        self.skipped += len(parsed) - len(new)
+        if not new:
+            return
+        recipes = Recipe.objects.bulk_create(item[0] for item in new)
+        # auto_now_add перезаписывает дату при вставке, поэтому исходная
+        # дата публикации восстанавливается отдельным запросом.
+        dated = []
+        for recipe, pub_date, _, _ in new:
+            if pub_date is not None:
+                recipe.pub_date = pub_date
+                dated.append(recipe)
+        Recipe.objects.bulk_update(dated, ['pub_date'])
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+            for recipe, _, tags, _ in new
+            for tag_id in dict.fromkeys(tags))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=recipe.id, ingredient_id=ingredient_id,
+                             amount=amount)
+            for recipe, _, _, ingredients in new
+            for ingredient_id, amount in dict(ingredients).items())
+        index_recipes(recipe.id for recipe in recipes)
+        record_changes(recipe.id for recipe in recipes)
+        bump_version(RECIPES)
+        self.created += len(recipes)
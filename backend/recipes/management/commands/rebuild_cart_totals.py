@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCartIngredient
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для пересчёта сводных списков покупок.
+    Запускается командой из папки backend
+    "python manage.py rebuild_cart_totals [--check]"
+    """
+    help = ('Пересчитывает сводные списки покупок с нуля или, с флагом '
+            '--check, сверяет их с содержимым корзин')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить расхождения, ничего не изменяя.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = self.drift()
+            if drift:
+                raise CommandError(
+                    f'Расхождений в сводных списках покупок: {drift}')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        # Удаление и пересчёт в одной транзакции: до её фиксации
+        # пользователи видят прежние списки покупок, а не пустые.
+        with transaction.atomic():
+            ShoppingCartIngredient.objects.all().delete()
+            ShoppingCartIngredient.objects.refresh(
+                User.objects.filter(
+                    user_shopping_cart__isnull=False).distinct())
+        self.stdout.write(self.style.SUCCESS(
+            'Сводные списки покупок пересчитаны: '
+            f'{ShoppingCartIngredient.objects.count()} строк.'))
+
+    def drift(self):
+        expected = {
+            (row['recipe__recipe_in_shopping_cart__user'],
+             row['ingredient']): row['total_amount']
+            for row in RecipeIngredient.objects
+            .filter(recipe__recipe_in_shopping_cart__isnull=False)
+            .values('recipe__recipe_in_shopping_cart__user', 'ingredient')
+            .annotate(total_amount=Sum('amount'))
+            .order_by()
+            .iterator()
+        }
+        drift = 0
+        for user_id, ingredient_id, total_amount in (
+                ShoppingCartIngredient.objects
+                .values_list('user_id', 'ingredient_id', 'total_amount')
+                .iterator()):
+            if expected.pop((user_id, ingredient_id), None) != total_amount:
+                drift += 1
+        return drift + len(expected)
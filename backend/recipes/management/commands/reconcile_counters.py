@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для сверки счётчиков популярности
+    рецептов с избранным и корзинами. Счётчики поддерживаются при каждом
+    добавлении и удалении, команда исправляет расхождения после загрузок
+    в обход моделей и ручных правок базы; её можно запускать по
+    расписанию.
+    Запускается командой из папки backend
+    "python manage.py reconcile_counters [--check]"
+    """
+    help = ('Исправляет favorites_count и carts_count рецептов или, с '
+            'флагом --check, только проверяет их')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить расхождения, ничего не изменяя.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = Recipe.objects.stale_counters().count()
+            if drift:
+                raise CommandError(
+                    f'Рецептов с неверными счётчиками: {drift}')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        fixed = Recipe.objects.reconcile_counters(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков у рецептов: {fixed}.'))
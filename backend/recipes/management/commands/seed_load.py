@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.seed import PASSWORD, seed_database
+
+
+class Command(BaseCommand):
+    """
+    Подключаемый модуль manage.py для наполнения базы синтетическими
+    данными перед нагрузочным тестированием. Ингредиенты берутся из
+    справочника data/ingredients.csv, подписки, избранное и корзины
+    распределяются по степенному закону. При одном и том же --seed
+    данные совпадают, повторный запуск требует другого --seed.
+    Запускается командой из папки backend
+    "python manage.py seed_load --users 1000 --recipes 20000"
+    """
+    help = 'Генерация воспроизводимого набора данных для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--subscriptions', type=int, default=20,
+                            help='Подписок на одного пользователя.')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Рецептов в избранном у пользователя.')
+        parser.add_argument('--carts', type=int, default=10,
+                            help='Рецептов в корзине у пользователя.')
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='Показатель степенного распределения популярности, '
+                 '0 — равномерное.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            users = seed_database(
+                users=options['users'],
+                recipes=options['recipes'],
+                ingredients_per_recipe=options['ingredients_per_recipe'],
+                subscriptions=options['subscriptions'],
+                favorites=options['favorites'],
+                carts=options['carts'],
+                seed=options['seed'],
+                tags=options['tags'],
+                exponent=options['exponent'] or None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: '
+            f'{options["recipes"]} за {time.perf_counter() - started:.1f} с. '
+            f'Пароль пользователей: {PASSWORD}.'))
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+def remove_duplicates(apps, schema_editor):
+    """Удаляет дубли, которые мешают создать ограничения уникальности.
+    Одноимённые рецепты автора не удаляются, а переименовываются.
+    """
+    changed_carts = False
+    for model_name, fields in (('Favorite', ('user', 'recipe')),
+                               ('ShoppingCart', ('user', 'recipe')),
+                               ('RecipeIngredient', ('recipe', 'ingredient'))):
+        model = apps.get_model('recipes', model_name)
+        duplicates = (model.objects.values(*fields)
+                      .annotate(count=models.Count('id'),
+                                keep=models.Min('id'))
+                      .filter(count__gt=1)
+                      .order_by())
+        for duplicate in duplicates:
+            keep = duplicate.pop('keep')
+            duplicate.pop('count')
+            model.objects.filter(**duplicate).exclude(id=keep).delete()
+            changed_carts = changed_carts or model_name != 'Favorite'
+    Recipe = apps.get_model('recipes', 'Recipe')
+    duplicates = (Recipe.objects.values('author', 'name')
+                  .annotate(count=models.Count('id'), keep=models.Min('id'))
+                  .filter(count__gt=1)
+                  .order_by())
+    for duplicate in duplicates:
+        for recipe in Recipe.objects.filter(
+                author=duplicate['author'], name=duplicate['name']
+        ).exclude(id=duplicate['keep']):
+            recipe.name = f'{recipe.name} ({recipe.id})'[:200]
+            recipe.save(update_fields=['name'])
+    if changed_carts:
+        rebuild_cart_totals(apps)
+    # Отложенные внешние ключи PostgreSQL проверяются сразу, иначе
+    # AddIndex и AddConstraint в той же транзакции завершатся ошибкой
+    # «pending trigger events».
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def rebuild_cart_totals(apps):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model('recipes',
+                                            'ShoppingCartIngredient')
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(
+            user_id=row['recipe__recipe_in_shopping_cart__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total_amount'])
+         for row in RecipeIngredient.objects
+         .filter(recipe__recipe_in_shopping_cart__isnull=False)
+         .values('recipe__recipe_in_shopping_cart__user', 'ingredient')
+         .annotate(total_amount=models.Sum('amount'))
+         .order_by()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-pub_date'], name='favorite_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', '-pub_date'], name='shoppingcart_user_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipe',
+            constraint=models.UniqueConstraint(fields=('author', 'name'), name='unique_author_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shoppingcart_recipe'),
+        ),
+    ]
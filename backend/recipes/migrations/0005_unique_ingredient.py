@@ -0,0 +1,69 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Объединяет одинаковые ингредиенты: ссылки рецептов переносятся
+    на ингредиент с наименьшим id, остальные удаляются.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = (Ingredient.objects.values('name', 'measurement_unit')
+                  .annotate(count=models.Count('id'), keep=models.Min('id'))
+                  .filter(count__gt=1)
+                  .order_by())
+    merged = False
+    for duplicate in duplicates:
+        extra = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=duplicate['keep'])
+        for ingredient_id in extra.values_list('id', flat=True):
+            rows = RecipeIngredient.objects.filter(ingredient_id=ingredient_id)
+            rows.filter(recipe__recipe_ingredient__ingredient_id=duplicate[
+                'keep']).delete()
+            rows.update(ingredient_id=duplicate['keep'])
+        extra.delete()
+        merged = True
+    if merged:
+        rebuild_cart_totals(apps)
+    # Отложенные внешние ключи PostgreSQL проверяются сразу, иначе
+    # AddConstraint в той же транзакции завершится ошибкой «pending
+    # trigger events».
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def rebuild_cart_totals(apps):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model('recipes',
+                                            'ShoppingCartIngredient')
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(
+            user_id=row['recipe__recipe_in_shopping_cart__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total_amount'])
+         for row in RecipeIngredient.objects
+         .filter(recipe__recipe_in_shopping_cart__isnull=False)
+         .values('recipe__recipe_in_shopping_cart__user', 'ingredient')
+         .annotate(total_amount=models.Sum('amount'))
+         .order_by()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
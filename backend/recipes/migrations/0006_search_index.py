@@ -0,0 +1,43 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe', verbose_name='рецепт')),
+                ('length', models.PositiveIntegerField(verbose_name='длина')),
+            ],
+            options={
+                'verbose_name': 'документ поискового индекса',
+                'verbose_name_plural': 'документы поискового индекса',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50, verbose_name='токен')),
+                ('frequency', models.PositiveIntegerField(verbose_name='частота')),
+                ('length', models.PositiveIntegerField(verbose_name='длина рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='recipes.recipe', verbose_name='рецепт')),
+            ],
+            options={
+                'verbose_name': 'токен поискового индекса',
+                'verbose_name_plural': 'токены поискового индекса',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchtoken',
+            constraint=models.UniqueConstraint(fields=('token', 'recipe'), name='unique_search_token'),
+        ),
+    ]
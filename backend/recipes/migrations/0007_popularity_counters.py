@@ -0,0 +1,41 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:09
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_popularity(apps, schema_editor):
+    """Заполняет счётчики по существующим записям избранного и корзин."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for field, model_name in (('favorites_count', 'Favorite'),
+                              ('carts_count', 'ShoppingCart')):
+        model = apps.get_model('recipes', model_name)
+        Recipe.objects.update(**{field: Coalesce(models.Subquery(
+            model.objects.filter(recipe=models.OuterRef('pk'))
+            .order_by().values('recipe')
+            .annotate(count=models.Count('id')).values('count')), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='число добавлений в список покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='число добавлений в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(count_popularity, migrations.RunPython.noop),
+    ]
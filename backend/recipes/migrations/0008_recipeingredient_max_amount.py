@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, 'Количество ингредиентов не может быть нулевым'), django.core.validators.MaxValueValidator(32767, 'Количество ингредиента не должно превышать 32767.')], verbose_name='количество'),
+        ),
+    ]
@@ -3,11 +3,17 @@ from colorfield.fields import ColorField
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import models, transaction
+from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Q,
+                              Subquery, Sum, UniqueConstraint, Window)
+from django.db.models.functions import Coalesce, RowNumber
+
+from users.models import Subscribe
 
 User = get_user_model()
 
+TOKEN_MAX_LENGTH = 50
+
 
 class Ingredient(models.Model):
     """Модель ингредиенты."""
@@ -18,6 +24,10 @@ class Ingredient(models.Model):
         ordering = ("name",)
         verbose_name = "ингредиент"
         verbose_name_plural = "ингредиенты"
+        constraints = [
+            UniqueConstraint(fields=['name', 'measurement_unit'],
+                             name='unique_ingredient'),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'[
@@ -39,6 +49,78 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    @staticmethod
+    def prefetch_lookups():
+        """Связанные объекты, которые нужны для вывода рецепта."""
+        return (
+            'tags',
+            Prefetch('recipe_ingredient',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+
+    def latest_by_author(self, authors, limit=None):
+        """Рецепты авторов, не более limit последних на каждого автора."""
+        queryset = self.filter(author__in=authors)
+        if limit is not None:
+            queryset = queryset.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )).filter(row_number__lte=limit)
+        return queryset
+
+    def with_user_flags(self, user):
+        """Отметки «в избранном», «в списке покупок» и подписки на автора
+        одним запросом.
+        """
+        if not user.is_authenticated:
+            return self.annotate(favorited=models.Value(False),
+                                 in_shopping_cart=models.Value(False),
+                                 author_subscribed=models.Value(False))
+        return self.annotate(
+            favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_subscribed=Exists(Subscribe.objects.filter(
+                user=user, following=OuterRef('author'))),
+        )
+
+    def stale_counters(self):
+        """id рецептов, у которых favorites_count и carts_count разошлись
+        с числом записей в избранном и корзинах, с верными значениями.
+        """
+        def counted(model):
+            return Coalesce(Subquery(
+                model.objects.filter(recipe=OuterRef('pk'))
+                .order_by().values('recipe')
+                .annotate(count=Count('id')).values('count')), 0)
+
+        return self.annotate(
+            actual_favorites=counted(Favorite),
+            actual_carts=counted(ShoppingCart),
+        ).filter(
+            ~Q(favorites_count=F('actual_favorites'))
+            | ~Q(carts_count=F('actual_carts')),
+        ).values_list('id', 'actual_favorites', 'actual_carts').order_by()
+
+    def reconcile_counters(self, batch_size=1000):
+        """Исправляет разошедшиеся счётчики рецептов. Возвращает число
+        исправленных рецептов.
+        """
+        stale = [self.model(id=recipe_id, favorites_count=favorites,
+                            carts_count=carts)
+                 for recipe_id, favorites, carts
+                 in self.stale_counters().iterator()]
+        self.model.objects.bulk_update(
+            stale, ['favorites_count', 'carts_count'], batch_size=batch_size)
+        return len(stale)
+
+
 class Recipe(models.Model):
     """Модель рецепты."""
     ingredients = models.ManyToManyField(
@@ -51,6 +133,12 @@ class Recipe(models.Model):
         verbose_name="картинка",
         help_text="Загрузите картинку"
     )
+    image_variants = models.JSONField(
+        'варианты картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     name = models.CharField(
         'название',
         max_length=200,
@@ -85,21 +173,60 @@ class Recipe(models.Model):
         verbose_name='дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        'число добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        'число добавлений в список покупок',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
-    def times_favorited(self):
-        return self.is_favorited.count()
-    times_favorited.short_description = 'Число добавлений рецепта в избранное'
+    COUNTER_FIELDS = ('favorites_count', 'carts_count')
 
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = "рецепт"
         verbose_name_plural = "рецепты"
-        UniqueConstraint(fields=['author', 'name'],
-                         name='unique_author_recipe')
+        constraints = [
+            UniqueConstraint(fields=['author', 'name'],
+                             name='unique_author_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_popular_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        self._save_counters = update_fields is not None and bool(
+            set(self.COUNTER_FIELDS) & set(update_fields))
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        # Счётчики меняются только UPDATE с F(), поэтому при обновлении
+        # рецепта их прочитанные ранее значения не записываются обратно,
+        # если они не перечислены в update_fields явно. Вставка, в том
+        # числе когда строки уже нет, пишет все поля как обычно.
+        if not getattr(self, '_save_counters', False):
+            values = [value for value in values
+                      if value[0].name not in self.COUNTER_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values,
+                                  update_fields, forced_update)
+
 
 class RecipeIngredient(models.Model):
     """Вспомогательная модель, связывающая рецепты и игредиенты."""
@@ -109,15 +236,62 @@ class RecipeIngredient(models.Model):
                                    on_delete=models.CASCADE,
                                    verbose_name="ингредиент",)
     amount = models.PositiveSmallIntegerField(
-        'количество', validators=[MinValueValidator(
-            settings.MIN_INGREDIENT_AMOUNT,
-            'Количество ингредиентов не может быть нулевым')])
+        'количество', validators=[
+            MinValueValidator(
+                settings.MIN_INGREDIENT_AMOUNT,
+                'Количество ингредиентов не может быть нулевым'),
+            MaxValueValidator(
+                settings.MAX_INGREDIENT_AMOUNT,
+                'Количество ингредиента не должно превышать '
+                f'{settings.MAX_INGREDIENT_AMOUNT}.')])
 
     class Meta:
         verbose_name = "ингредиент рецепта"
         verbose_name_plural = "ингредиенты рецепта"
-        UniqueConstraint(fields=['recipe', 'ingredient'],
-                         name='unique_recipe_ingredient')
+        constraints = [
+            UniqueConstraint(fields=['recipe', 'ingredient'],
+                             name='unique_recipe_ingredient'),
+        ]
+
+
+class SearchDocument(models.Model):
+    """Рецепт в поисковом индексе: число его токенов с учётом весов
+    полей. Нужно для средней длины рецепта в ранжировании BM25.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        verbose_name='рецепт')
+    length = models.PositiveIntegerField('длина')
+
+    class Meta:
+        verbose_name = "документ поискового индекса"
+        verbose_name_plural = "документы поискового индекса"
+
+
+class SearchToken(models.Model):
+    """Обратный индекс: нормализованное слово и рецепты, в которых оно
+    встречается, с частотой. Длина рецепта повторяется в каждой записи,
+    чтобы ранжирование обходилось без соединения таблиц.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='search_tokens',
+        verbose_name='рецепт')
+    token = models.CharField('токен', max_length=TOKEN_MAX_LENGTH)
+    frequency = models.PositiveIntegerField('частота')
+    length = models.PositiveIntegerField('длина рецепта')
+
+    class Meta:
+        verbose_name = "токен поискового индекса"
+        verbose_name_plural = "токены поискового индекса"
+        constraints = [
+            UniqueConstraint(fields=['token', 'recipe'],
+                             name='unique_search_token'),
+        ]
 
 
 class ShoppingCart(models.Model):
@@ -141,8 +315,14 @@ class ShoppingCart(models.Model):
         ordering = ("-pub_date",)
         verbose_name = "список покупок"
         verbose_name_plural = "список покупок"
-        UniqueConstraint(fields=['user', 'recipe'],
-                         name='unique_shoppingcart_recipe')
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipe'],
+                             name='unique_shoppingcart_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date'],
+                         name='shoppingcart_user_date_idx'),
+        ]
 
 
 class Favorite(models.Model):
@@ -169,5 +349,73 @@ class Favorite(models.Model):
         ordering = ("recipe",)
         verbose_name = "добавлен в избанное"
         verbose_name_plural = "добавлен в избранное"
-        UniqueConstraint(fields=['user', 'recipe'],
-                         name='unique_favorite_recipe')
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipe'],
+                             name='unique_favorite_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date'],
+                         name='favorite_user_date_idx'),
+        ]
+
+
+class ShoppingCartIngredientManager(models.Manager):
+
+    @transaction.atomic
+    def refresh(self, users, ingredients=None):
+        """Пересчитывает сводный список покупок пользователей users.
+        Если переданы ingredients, пересчитываются только эти позиции.
+        """
+        # Суммы записываются вставкой с обновлением при конфликте, а
+        # удаляются только позиции, которых больше нет ни в одном рецепте
+        # корзины. Поэтому одновременные пересчёты для одного
+        # пользователя не нарушают уникальность пары.
+        stale = self.filter(user__in=users)
+        totals = RecipeIngredient.objects.filter(
+            recipe__recipe_in_shopping_cart__user__in=users)
+        if ingredients is not None:
+            stale = stale.filter(ingredient__in=ingredients)
+            totals = totals.filter(ingredient__in=ingredients)
+        self.bulk_create(
+            (self.model(user_id=row['recipe__recipe_in_shopping_cart__user'],
+                        ingredient_id=row['ingredient'],
+                        total_amount=row['total_amount'])
+             for row in totals
+             .values('recipe__recipe_in_shopping_cart__user', 'ingredient')
+             .annotate(total_amount=Sum('amount'))
+             .order_by()),
+            batch_size=1000, update_conflicts=True,
+            unique_fields=['user', 'ingredient'],
+            update_fields=['total_amount'])
+        stale.exclude(Exists(RecipeIngredient.objects.filter(
+            recipe__recipe_in_shopping_cart__user=OuterRef('user'),
+            ingredient=OuterRef('ingredient')))).delete()
+
+
+class ShoppingCartIngredient(models.Model):
+    """Сводный список покупок: суммарное количество каждого ингредиента
+    по всем рецептам в списке покупок пользователя.
+    Поддерживается при изменении списка покупок и ингредиентов рецепта
+    через API и админку. Ингредиенты, изменённые в обход них, например
+    запросом к базе, учитываются после rebuild_cart_totals.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='владелец корзины',
+        related_name='shopping_cart_ingredients')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='ингредиент')
+    total_amount = models.PositiveIntegerField('количество')
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = "ингредиент списка покупок"
+        verbose_name_plural = "ингредиенты списка покупок"
+        constraints = [
+            UniqueConstraint(fields=['user', 'ingredient'],
+                             name='unique_cart_ingredient_total'),
+        ]
@@ -0,0 +1,175 @@
+import heapq
+import threading
+from collections import Counter, defaultdict
+from itertools import compress
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import RecipeIngredient
+
+VERSION_KEY = 'pantry:version'
+
+
+def changes_key(version):
+    return f'pantry:changes:{version}'
+
+
+def record_changes(recipe_ids=None):
+    """Записывает в общий кэш, что ингредиенты рецептов recipe_ids
+    изменились; None — изменилось всё, индекс нужно построить заново.
+    Запись делается после фиксации текущей транзакции.
+    """
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+
+    def record():
+        cache = caches['versions']
+        cache.add(VERSION_KEY, 0, timeout=None)
+        version = cache.incr(VERSION_KEY)
+        # Файловый кэш увеличивает счётчик не атомарно, поэтому занятый
+        # номер пропускается.
+        while not cache.add(changes_key(version), recipe_ids,
+                            settings.PANTRY_CHANGES_TIMEOUT):
+            version = cache.incr(VERSION_KEY)
+        # Более старые записи не читаются: отставший на столько версий
+        # индекс строится заново.
+        cache.delete(changes_key(version - settings.PANTRY_MAX_CHANGES))
+    transaction.on_commit(record)
+
+
+class PantryIndex:
+    """Ингредиенты рецептов в памяти процесса для подбора рецептов
+    по продуктам, которые есть у пользователя.
+
+    Ингредиенты рецепта хранятся битовой маской: каждому ингредиенту
+    соответствует свой бит, частым ингредиентам — младшие, чтобы маски
+    были короче. Число совпадений с продуктами пользователя — это
+    popcount пересечения масок. Индекс обновляется по журналу изменений
+    в общем кэше и строится заново, если журнал потерян.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.positions = {}
+        self.ingredient_ids = []
+        self.slots = {}
+        self.recipe_ids = []
+        self.masks = []
+        self.sizes = []
+
+    def position(self, ingredient_id):
+        if ingredient_id not in self.positions:
+            self.positions[ingredient_id] = len(self.ingredient_ids)
+            self.ingredient_ids.append(ingredient_id)
+        return self.positions[ingredient_id]
+
+    def load_masks(self, rows):
+        masks = defaultdict(int)
+        for recipe_id, ingredient_id in rows:
+            masks[recipe_id] |= 1 << self.position(ingredient_id)
+        return masks
+
+    def rebuild(self):
+        rows = list(RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id').order_by().iterator())
+        popularity = Counter(ingredient_id for _, ingredient_id in rows)
+        self.positions, self.ingredient_ids = {}, []
+        for ingredient_id, _ in popularity.most_common():
+            self.position(ingredient_id)
+        masks = self.load_masks(rows)
+        self.recipe_ids = list(masks)
+        self.masks = list(masks.values())
+        self.sizes = [mask.bit_count() for mask in self.masks]
+        self.slots = {recipe_id: slot
+                      for slot, recipe_id in enumerate(self.recipe_ids)}
+
+    def update(self, recipe_ids):
+        masks = self.load_masks(RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id').order_by())
+        for recipe_id in recipe_ids:
+            # У удалённого рецепта маска пустая, его слот просто
+            # перестаёт совпадать с любым запросом.
+            mask = masks.get(recipe_id, 0)
+            slot = self.slots.get(recipe_id)
+            if slot is None:
+                if not mask:
+                    continue
+                self.slots[recipe_id] = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+                self.masks.append(mask)
+                self.sizes.append(mask.bit_count())
+            else:
+                self.masks[slot] = mask
+                self.sizes[slot] = mask.bit_count()
+
+    def refresh(self):
+        cache = caches['versions']
+        version = cache.get(VERSION_KEY, 0)
+        if self.version == version:
+            return
+        with self.lock:
+            if self.version == version:
+                return
+            changes = None
+            if self.version is not None and self.version < version and (
+                    version - self.version <= settings.PANTRY_MAX_CHANGES):
+                keys = [changes_key(number)
+                        for number in range(self.version + 1, version + 1)]
+                logged = cache.get_many(keys)
+                if len(logged) == len(keys) and None not in logged.values():
+                    changes = {recipe_id for recipe_ids in logged.values()
+                               for recipe_id in recipe_ids}
+            if changes is None:
+                self.rebuild()
+            else:
+                self.update(changes)
+            self.version = version
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """Не более limit рецептов, в которых есть хотя бы один из
+        ingredient_ids: кортежи (id рецепта, доля имеющихся ингредиентов,
+        id недостающих ингредиентов) по убыванию доли, затем по числу
+        недостающих.
+        """
+        self.refresh()
+        with self.lock:
+            return self.find(ingredient_ids, limit, max_missing)
+
+    def find(self, ingredient_ids, limit, max_missing):
+        wanted = 0
+        for ingredient_id in ingredient_ids:
+            if ingredient_id in self.positions:
+                wanted |= 1 << self.positions[ingredient_id]
+        if not wanted:
+            return []
+        if max_missing is None:
+            max_missing = len(self.ingredient_ids)
+        # Пересечение и popcount для всех рецептов считаются встроенными
+        # map и compress без цикла на Python.
+        matched = list(map(int.bit_count, map(wanted.__and__, self.masks)))
+        candidates = [
+            (count / size, count - size, recipe_id, mask)
+            for recipe_id, mask, size, count in compress(
+                zip(self.recipe_ids, self.masks, self.sizes, matched),
+                matched)
+            if size - count <= max_missing]
+        return [(recipe_id, coverage, self.ingredients(mask & ~wanted))
+                for coverage, _, recipe_id, mask
+                in heapq.nlargest(limit, candidates)]
+
+    def ingredients(self, mask):
+        """id ингредиентов, которым соответствуют биты mask."""
+        result = []
+        while mask:
+            bit = mask & -mask
+            result.append(self.ingredient_ids[bit.bit_length() - 1])
+            mask ^= bit
+        return result
+
+
+pantry_index = PantryIndex()
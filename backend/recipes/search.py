@@ -0,0 +1,205 @@
+import math
+import re
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import (Recipe, RecipeIngredient, SearchDocument, SearchToken,
+                     TOKEN_MAX_LENGTH)
+
+WORD = re.compile(r'[^\W_]+')
+STOP_WORDS = frozenset(
+    'а без в во для до же за и из или к ко на не но о об от по при с со у'
+    .split())
+
+VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND = re.compile(
+    r'((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$')
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVAL = re.compile(
+    r'(((?<=[ая])(ем|нн|вш|ющ|щ))|(ивш|ывш|ующ))?'
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых'
+    r'|ую|юю|ая|яя|ою|ею)$')
+VERB = re.compile(
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)'
+    r'|(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло'
+    r'|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$')
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем'
+    r'|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$')
+DERIVATIONAL = re.compile(r'ость?$')
+SUPERLATIVE = re.compile(r'ейше?$')
+REGION = re.compile(f'[{VOWELS}][^{VOWELS}]')
+
+
+def stem(word):
+    """Русский стеммер Snowball: отбрасывает окончания и суффиксы,
+    чтобы разные формы слова («томаты», «томатов») давали один токен.
+    Слова без русских гласных возвращаются без изменений.
+    """
+    match = re.search(f'[{VOWELS}]', word)
+    if match is None:
+        return word
+    prefix, rv = word[:match.end()], word[match.end():]
+    r1 = REGION.search(word)
+    r1 = r1.end() if r1 else len(word)
+    r2 = REGION.search(word, r1)
+    r2 = r2.end() if r2 else len(word)
+    rv, removed = PERFECTIVE_GERUND.subn('', rv)
+    if not removed:
+        rv = REFLEXIVE.sub('', rv)
+        for ending in (ADJECTIVAL, VERB, NOUN):
+            rv, removed = ending.subn('', rv)
+            if removed:
+                break
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    match = DERIVATIONAL.search(rv)
+    if match and len(prefix) + match.start() >= r2:
+        rv = rv[:match.start()]
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        rv, removed = SUPERLATIVE.subn('', rv)
+        if removed and rv.endswith('нн'):
+            rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text):
+    """Нормализованные слова текста: нижний регистр, «ё» как «е»,
+    без служебных слов, после стемминга.
+    """
+    for word in WORD.findall(text.casefold().replace('ё', 'е')):
+        if len(word) > 1 and word not in STOP_WORDS:
+            yield stem(word)[:TOKEN_MAX_LENGTH]
+
+
+def document_tokens(name, text, ingredients):
+    """Частоты токенов рецепта с учётом весов полей
+    SEARCH_FIELD_WEIGHTS.
+    """
+    weights = settings.SEARCH_FIELD_WEIGHTS
+    tokens = Counter()
+    for field, values in (('name', [name]), ('text', [text]),
+                          ('ingredients', ingredients)):
+        for value in values:
+            for token in tokenize(value):
+                tokens[token] += weights[field]
+    return tokens
+
+
+def index_recipes(recipe_ids):
+    """Перестраивает записи обратного индекса для рецептов recipe_ids.
+    Удалённые рецепты пропускаются.
+    """
+    recipe_ids = iter(recipe_ids)
+    indexed = 0
+    while True:
+        batch = list(islice(recipe_ids, settings.SEARCH_INDEX_BATCH_SIZE))
+        if not batch:
+            return indexed
+        indexed += index_batch(batch)
+
+
+@transaction.atomic
+def index_batch(recipe_ids):
+    ingredients = defaultdict(list)
+    for recipe_id, name in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient__name').order_by():
+        ingredients[recipe_id].append(name)
+    documents, tokens = [], []
+    for recipe_id, name, text in Recipe.objects.filter(
+            id__in=recipe_ids).values_list('id', 'name', 'text').order_by():
+        frequencies = document_tokens(name, text, ingredients[recipe_id])
+        length = sum(frequencies.values())
+        documents.append(SearchDocument(recipe_id=recipe_id, length=length))
+        tokens.extend(
+            SearchToken(recipe_id=recipe_id, token=token,
+                        frequency=frequency, length=length)
+            for token, frequency in frequencies.items())
+    SearchToken.objects.filter(recipe_id__in=recipe_ids).delete()
+    SearchDocument.objects.filter(recipe_id__in=recipe_ids).delete()
+    SearchDocument.objects.bulk_create(documents)
+    SearchToken.objects.bulk_create(tokens, batch_size=1000)
+    return len(documents)
+
+
+def schedule_index(recipe_ids):
+    """Обновляет индекс после фиксации текущей транзакции, когда
+    ингредиенты и теги рецепта уже сохранены.
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: index_recipes(recipe_ids))
+
+
+def get_stats():
+    """Число проиндексированных рецептов и их средняя длина."""
+    stats = cache.get('search:stats')
+    if stats is None:
+        stats = SearchDocument.objects.aggregate(
+            documents=Count('recipe_id'), average_length=Avg('length'))
+        cache.set('search:stats', stats, settings.SEARCH_STATS_TIMEOUT)
+    return stats['documents'], stats['average_length'] or 1
+
+
+def get_document_frequencies(terms):
+    """Число рецептов, в которых встречается каждый из terms."""
+    keys = {term: f'search:df:{term}' for term in terms}
+    cached = cache.get_many(keys.values())
+    frequencies = {term: cached[key] for term, key in keys.items()
+                   if key in cached}
+    missing = [term for term in terms if term not in frequencies]
+    if missing:
+        counted = dict.fromkeys(missing, 0)
+        counted.update(SearchToken.objects.filter(token__in=missing)
+                       .values('token').annotate(count=Count('id'))
+                       .values_list('token', 'count').order_by())
+        cache.set_many({keys[term]: count for term, count in counted.items()},
+                       settings.SEARCH_STATS_TIMEOUT)
+        frequencies.update(counted)
+    return frequencies
+
+
+def search_ranking(query):
+    """Релевантность BM25 рецептов, подходящих под query: записи
+    индекса, сгруппированные по recipe_id, с суммой score.
+    Рецепт подходит, если в нём есть хотя бы одно слово запроса. Слова,
+    которые встречаются в большинстве рецептов, почти не влияют на
+    порядок, поэтому отбрасываются, если в запросе есть более редкие.
+    Возвращает None, если подходящих рецептов нет.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:settings.SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    documents, average_length = get_stats()
+    frequencies = {term: count for term, count
+                   in get_document_frequencies(terms).items() if count}
+    rare = {term: count for term, count in frequencies.items()
+            if count <= documents * settings.SEARCH_COMMON_TERM_RATIO}
+    frequencies = rare or frequencies
+    if not frequencies:
+        return None
+    idf = {term: math.log(1 + (documents - count + 0.5) / (count + 0.5))
+           for term, count in frequencies.items()}
+    k1, b = settings.SEARCH_BM25_K1, settings.SEARCH_BM25_B
+    frequency = Cast('frequency', FloatField())
+    saturation = frequency + k1 * (
+        1 - b + b * Cast('length', FloatField()) / average_length)
+    weight = Case(*(When(token=term, then=Value(value))
+                    for term, value in idf.items()),
+                  output_field=FloatField())
+    return (SearchToken.objects
+            .filter(token__in=idf)
+            .values('recipe_id')
+            .annotate(score=Sum(weight * frequency * (k1 + 1) / saturation))
+            .order_by())
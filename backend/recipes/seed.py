@@ -0,0 +1,149 @@
+import csv
+import os
+import random
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from users.models import Subscribe
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingCartIngredient, Tag)
+from .pantry import record_changes
+from .search import index_recipes
+
+User = get_user_model()
+
+SAMPLE_IMAGES = (
+    'recipes/бутерброд_с_сыром.jpg',
+    'recipes/вареное_яйцо.jpeg',
+    'recipes/омлет.jpeg',
+    'recipes/шашлык.jpg',
+)
+SAMPLE_TAGS = (
+    ('Завтрак', '#6FFF20', 'breakfast'),
+    ('Обед', '#455EFF', 'lunch'),
+    ('Ужин', '#FF5733', 'dinner'),
+)
+BATCH_SIZE = 1000
+PASSWORD = 'benchmark-password'
+
+
+def ensure_ingredients():
+    """Загружает справочник ингредиентов, если таблица пуста."""
+    if not Ingredient.objects.exists():
+        path = os.path.join(os.path.dirname(settings.BASE_DIR),
+                            'data', 'ingredients.csv')
+        with open(path, encoding='utf-8') as csv_file:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in csv.reader(csv_file)),
+                batch_size=BATCH_SIZE)
+    return list(Ingredient.objects.values_list('id', flat=True))
+
+
+def ensure_tags(count=len(SAMPLE_TAGS)):
+    """Создаёт примеры тегов и, если нужно больше, нумерованные теги."""
+    tags = list(SAMPLE_TAGS[:count]) + [
+        (f'Тег {i}', f'#{i:06X}', f'tag{i}')
+        for i in range(len(SAMPLE_TAGS), count)]
+    for name, color, slug in tags:
+        Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color})
+    return list(Tag.objects.values_list('id', flat=True))
+
+
+def power_law_sampler(rng, population, exponent):
+    """Возвращает функцию выборки k разных элементов, в которой
+    вероятность элемента убывает как 1 / rank ** exponent. Порядок
+    популярности случайный, но определяется зерном генератора.
+    При exponent=None выборка равномерная.
+    """
+    if exponent is None:
+        return lambda k: rng.sample(population, min(k, len(population)))
+    ranked = rng.sample(population, len(population))
+    cum_weights = list(accumulate(
+        1 / rank ** exponent for rank in range(1, len(ranked) + 1)))
+
+    def sample(k):
+        k = min(k, len(ranked))
+        chosen = {}
+        while len(chosen) < k:
+            if 2 * len(chosen) >= len(ranked):
+                # Когда выбрана большая часть элементов, повторные
+                # попадания в популярные почти не дают новых, поэтому
+                # остаток добирается равномерно из невыбранных.
+                rest = [item for item in ranked if id(item) not in chosen]
+                for item in rng.sample(rest, k - len(chosen)):
+                    chosen[id(item)] = item
+                break
+            for item in rng.choices(ranked, cum_weights=cum_weights,
+                                    k=k - len(chosen)):
+                chosen.setdefault(id(item), item)
+        return list(chosen.values())
+    return sample
+
+
+def seed_database(users=20, recipes=200, ingredients_per_recipe=8,
+                  subscriptions=10, favorites=20, carts=10, seed=0,
+                  tags=len(SAMPLE_TAGS), exponent=None):
+    """Заполняет базу синтетическими данными пакетными вставками.
+
+    subscriptions, favorites и carts задаются в расчёте на одного
+    пользователя. С exponent авторы рецептов, подписки, избранное и
+    корзины распределяются по степенному закону: немногие авторы и
+    рецепты популярны, остальные встречаются редко.
+    Возвращает список созданных пользователей.
+    """
+    rng = random.Random(seed)
+    ingredient_ids = ensure_ingredients()
+    tag_ids = ensure_tags(tags)
+    password = make_password(PASSWORD)
+    prefix = f'seed{seed}'
+    created_users = User.objects.bulk_create(
+        (User(username=f'{prefix}_user{i}',
+              email=f'{prefix}_user{i}@example.com',
+              first_name='Имя', last_name='Фамилия', password=password)
+         for i in range(users)),
+        batch_size=BATCH_SIZE)
+    sample_authors = power_law_sampler(rng, created_users, exponent)
+    created_recipes = Recipe.objects.bulk_create(
+        (Recipe(author=sample_authors(1)[0],
+                name=f'Рецепт {i}',
+                text='Описание рецепта',
+                image=rng.choice(SAMPLE_IMAGES),
+                cooking_time=rng.randint(1, 180))
+         for i in range(recipes)),
+        batch_size=BATCH_SIZE)
+    RecipeIngredient.objects.bulk_create(
+        (RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                          amount=rng.randint(1, 500))
+         for recipe in created_recipes
+         for ingredient_id in rng.sample(
+             ingredient_ids, min(ingredients_per_recipe,
+                                 len(ingredient_ids)))),
+        batch_size=BATCH_SIZE)
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+         for recipe in created_recipes
+         for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))),
+        batch_size=BATCH_SIZE)
+    Subscribe.objects.bulk_create(
+        (Subscribe(user=user, following=author)
+         for user in created_users
+         for author in [other for other in sample_authors(subscriptions + 1)
+                        if other != user][:subscriptions]),
+        batch_size=BATCH_SIZE)
+    sample_recipes = power_law_sampler(rng, created_recipes, exponent)
+    for model, per_user in ((Favorite, favorites), (ShoppingCart, carts)):
+        model.objects.bulk_create(
+            (model(user=user, recipe=recipe)
+             for user in created_users
+             for recipe in sample_recipes(per_user)),
+            batch_size=BATCH_SIZE)
+    ShoppingCartIngredient.objects.refresh(created_users)
+    Recipe.objects.reconcile_counters()
+    index_recipes(recipe.id for recipe in created_recipes)
+    record_changes()
+    return created_users
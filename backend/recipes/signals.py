@@ -0,0 +1,140 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import (INGREDIENTS, RECIPES, TAGS, bump_version,
+                    invalidate_recipes)
+from .images import schedule_variants
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingCartIngredient, Tag)
+from .pantry import record_changes
+from .search import schedule_index
+
+User = get_user_model()
+
+COUNTERS = {Favorite: 'favorites_count', ShoppingCart: 'carts_count'}
+
+
+def cart_ingredients(recipe_id):
+    return list(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        ShoppingCartIngredient.objects.refresh(
+            [instance.user_id], cart_ingredients(instance.recipe_id))
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    # При каскадном удалении рецепта его ингредиенты могут быть уже
+    # удалены, тогда список покупок пересчитывается целиком.
+    ShoppingCartIngredient.objects.refresh(
+        [instance.user_id], cart_ingredients(instance.recipe_id) or None)
+
+
+def change_counter(recipe_id, field, delta):
+    """Меняет счётчик рецепта одним UPDATE без чтения строки, поэтому
+    одновременные добавления не теряются.
+    """
+    Recipe.objects.filter(pk=recipe_id).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def popularity_increased(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.recipe_id, COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def popularity_decreased(sender, instance, **kwargs):
+    change_counter(instance.recipe_id, COUNTERS[sender], -1)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_search_changed(sender, instance, created, **kwargs):
+    if not created:
+        schedule_index(RecipeIngredient.objects.filter(
+            ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    # Ингредиент удаляется вместе со связями всех его рецептов.
+    record_changes()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(sender, **kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipes_count_changed(sender, created=True, **kwargs):
+    if created:
+        bump_version(RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        schedule_index([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    # Ингредиенты рецепта сохраняются после самого рецепта в той же
+    # транзакции, record_changes учитывает их после фиксации.
+    record_changes([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if instance.image and (instance.image_variants.get('source')
+                           != instance.image.name):
+        schedule_variants(instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # Теги входят в условия фильтров, поэтому сохранённые числа
+    # рецептов тоже устаревают.
+    bump_version(RECIPES)
+    if not reverse:
+        invalidate_recipes([instance.pk])
+    elif pk_set:
+        invalidate_recipes(pk_set)
+    else:
+        bump_version(TAGS)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_recipes(
+        instance.recipes.values_list('id', flat=True))
@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from .management.commands.benchmark_api import (
+    LOCAL_CACHES, Command as BenchmarkCommand)
+from .models import Ingredient, Recipe, ShoppingCart, ShoppingCartIngredient
+from .seed import seed_database
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BenchmarkBudgetsTest(TestCase):
+    """Сценарии benchmark_api на синтетических данных укладываются
+    в бюджеты по числу запросов, времени и памяти.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=20, recipes=200)[0]
+
+    def test_budgets(self):
+        command = BenchmarkCommand(stdout=StringIO())
+        results = command.run(self.user, {'repeat': 3, 'explain': False})
+        try:
+            command.check_budgets(results)
+        except CommandError as error:
+            self.fail(str(error))
+
+
+class ShoppingCartTotalsTest(TestCase):
+    """Пересчёт сводного списка покупок поверх существующих строк."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=3, recipes=20, carts=5)[0]
+
+    def test_refresh_updates_in_place(self):
+        ShoppingCartIngredient.objects.filter(user=self.user).update(
+            total_amount=1)
+        ShoppingCartIngredient.objects.refresh([self.user])
+        call_command('rebuild_cart_totals', check=True, stdout=StringIO())
+
+    def test_refresh_removes_unused_ingredients(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertFalse(ShoppingCartIngredient.objects.filter(
+            user=self.user).exists())
+        call_command('rebuild_cart_totals', check=True, stdout=StringIO())
+
+
+class SeedDatabaseTest(TestCase):
+    """Число подписок каждого пользователя точно равно заданному."""
+    def test_subscriptions(self):
+        for seed, exponent in enumerate((None, 1.5)):
+            with self.subTest(exponent=exponent):
+                users = seed_database(users=10, recipes=10, subscriptions=3,
+                                      seed=seed, exponent=exponent)
+                for user in users:
+                    self.assertEqual(user.follower.count(), 3)
+
+
+class ImportRecipesTest(TestCase):
+    """import_recipes пропускает строки со значениями вне допустимых
+    диапазонов и загружает остальные.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_database(users=1, recipes=0)[0]
+
+    def write(self, records):
+        descriptor, path = tempfile.mkstemp(suffix='.ndjson')
+        self.addCleanup(os.remove, path)
+        ingredient = Ingredient.objects.first()
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as output:
+            for name, cooking_time, amount in records:
+                output.write(json.dumps({
+                    'name': name, 'text': 'Описание рецепта',
+                    'cooking_time': cooking_time, 'tags': ['breakfast'],
+                    'ingredients': [{
+                        'name': ingredient.name,
+                        'measurement_unit': ingredient.measurement_unit,
+                        'amount': amount}],
+                }, ensure_ascii=False) + '\n')
+        return path
+
+    def test_out_of_range_values(self):
+        path = self.write([('Без времени', 0, 10),
+                           ('Долгий', 40000, 10),
+                           ('Много', 10, 40000),
+                           ('Пустой', 10, 0),
+                           ('Верный', 10, 10)])
+        stderr = StringIO()
+        call_command('import_recipes', path, author=self.user.username,
+                     stdout=StringIO(), stderr=stderr)
+        self.assertEqual(list(Recipe.objects.values_list('name', flat=True)),
+                         ['Верный'])
+        self.assertEqual(len(stderr.getvalue().splitlines()), 4)
+
+
+class RecipeSaveTest(TestCase):
+    """Сохранение рецепта не затирает счётчики, но в остальном ведёт
+    себя как обычный save().
+    """
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(users=2, recipes=2)
+
+    def setUp(self):
+        self.recipe = Recipe.objects.first()
+
+    def test_stale_counters_kept(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=42)
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.recipe.favorites_count, 42)
+
+    def test_explicit_counters_saved(self):
+        self.recipe.favorites_count = 7
+        self.recipe.save(update_fields=['favorites_count'])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 7)
+
+    def test_missing_row_inserted(self):
+        Recipe.objects.filter(pk=self.recipe.pk).delete()
+        self.recipe.save()
+        self.assertTrue(Recipe.objects.filter(pk=self.recipe.pk).exists())
+
+    def test_deferred_fields_kept(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(text='Новый текст')
+        recipe = Recipe.objects.only('id', 'name').get(pk=self.recipe.pk)
+        recipe.name = 'Новое название'
+        recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.text, 'Новый текст')
+        self.assertEqual(self.recipe.name, 'Новое название')